@@ -0,0 +1,55 @@
+import argparse
+import time
+
+import numpy as np
+from PIL import Image
+
+from utils.utils import get_font
+from utils.video import FONT_PATH, _draw_top_label, render_label_sprite, composite_sprite
+
+
+def _pil_caption(frame, caption, font):
+    img = Image.fromarray(frame)
+    img = _draw_top_label(img, caption, font)
+    return np.array(img)
+
+def _measure(fn, frames):
+    start = time.perf_counter()
+    for frame in frames:
+        fn(frame)
+    elapsed = time.perf_counter() - start
+    return len(frames) / elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=720)
+    parser.add_argument("--height", type=int, default=1280)
+    parser.add_argument("--frames", type=int, default=96)
+    parser.add_argument("--font_path", type=str, default=FONT_PATH)
+    parser.add_argument("--caption", type=str, default="1. Elephant")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    frames = [
+        rng.integers(0, 256, size=(args.height, args.width, 3), dtype=np.uint8)
+        for _ in range(args.frames)
+    ]
+    font = get_font(args.font_path, size=max(54, int(args.width / 12)))
+
+    before = _measure(lambda f: _pil_caption(f, args.caption, font), frames)
+
+    setup_start = time.perf_counter()
+    sprite = render_label_sprite(args.caption, font, (args.width, args.height))
+    setup = time.perf_counter() - setup_start
+    after = _measure(lambda f: composite_sprite(f, sprite), frames)
+
+    diff = np.abs(
+        _pil_caption(frames[0], args.caption, font).astype(np.int16)
+        - composite_sprite(frames[0], sprite).astype(np.int16)
+    )
+
+    print(f"[Bench] {args.frames} frames @ {args.width}x{args.height}")
+    print(f"[Bench] PIL per-frame : {before:8.1f} fps")
+    print(f"[Bench] sprite blend  : {after:8.1f} fps (sprite setup {setup * 1000:.1f} ms)")
+    print(f"[Bench] speedup       : {after / before:8.2f}x")
+    print(f"[Bench] max pixel diff: {int(diff.max())}")
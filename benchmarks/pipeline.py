@@ -0,0 +1,513 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import glob
+import random
+import shutil
+import socket
+import argparse
+import threading
+import subprocess
+import urllib.request
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.memory import run_child
+from utils.trace import summarize
+
+PROVIDERS = ("replicate", "suno", "openai", "youtube", "tiktok")
+
+CLIP_SIZE = "720x1280"  # matches VIDEO_PARAMS (720p, 9:16) so downloads validate
+CLIP_FPS = 24
+CLIP_SEC = 4
+
+
+def parse_provider_map(spec: str, default: float = 0.0) -> dict:
+    """
+    "replicate=2,suno=4" -> {"replicate": 2.0, "suno": 4.0, "openai": 0.0, ...}
+    """
+    out = {p: default for p in PROVIDERS}
+    for item in filter(None, (spec or "").split(",")):
+        name, value = item.split("=")
+        if name not in out:
+            raise ValueError(f"unknown provider '{name}'")
+        out[name] = float(value)
+    return out
+
+def make_assets(asset_dir: str) -> dict:
+    """
+    Synthetic provider outputs, generated once with ffmpeg: a still image,
+    a 4s 24fps 720x1280 clip and a 30s MP3.
+    """
+    os.makedirs(asset_dir, exist_ok=True)
+    base = ["ffmpeg", "-y", "-loglevel", "error"]
+    specs = {
+        "image.jpg": ["-f", "lavfi", "-i", f"testsrc2=size={CLIP_SIZE}", "-frames:v", "1"],
+        "clip.mp4": [
+            "-f", "lavfi", "-i", f"testsrc2=size={CLIP_SIZE}:rate={CLIP_FPS}:duration={CLIP_SEC}",
+            "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+        ],
+        "bgm.mp3": ["-f", "lavfi", "-i", "sine=frequency=440:duration=30", "-c:a", "libmp3lame"],
+    }
+    paths = {}
+    for name, args in specs.items():
+        path = os.path.join(asset_dir, name)
+        if not os.path.exists(path):
+            subprocess.run(base + args + [path], check=True)
+        paths[name] = path
+    return paths
+
+
+class FakeProviderServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the HTTP providers: serves the synthetic assets,
+    the Suno generate/record-info endpoints (and posts the "complete"
+    callback to a local `callBackUrl`), the YouTube resumable upload
+    protocol and the TikTok inbox init + chunk PUTs, with per-provider
+    latency and failure injection.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, assets: dict, latency: dict, fail: dict, seed: int = 0, port: int = 0):
+        super().__init__(("127.0.0.1", port), _FakeHandler)
+        self.assets = assets
+        self.latency = latency
+        self.fail = fail
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tasks = {}
+        self.uploads = {}
+        self.tiktok_uploads = {}
+        self.calls = {}
+        self.injected = {}
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def hit(self, endpoint: str, provider: str = None) -> bool:
+        """
+        Count a call, sleep the provider's latency; True if a failure is injected.
+        """
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            failed = provider is not None and self.rng.random() < self.fail.get(provider, 0.0)
+            if failed:
+                self.injected[endpoint] = self.injected.get(endpoint, 0) + 1
+        if provider is not None and self.latency.get(provider):
+            time.sleep(self.latency[provider])
+        return failed
+
+    def post_callback(self, url: str, task_id: str):
+        payload = {
+            "code": 200,
+            "msg": "All generated successfully.",
+            "data": {
+                "callbackType": "complete",
+                "task_id": task_id,
+                "data": [{"id": task_id, "audio_url": f"{self.base_url}/files/bgm.mp3"}],
+            },
+        }
+        req = urllib.request.Request(
+            url, data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST",
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=5) as resp:
+                status = resp.status
+        except OSError as e:
+            status = getattr(e, "code", None) or repr(e)
+        endpoint = "suno.callback" if status == 200 else "suno.callback_rejected"
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-providers", daemon=True).start()
+        return self
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b"", headers: dict = None, content_type: str = "application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _json(self, status: int, obj, headers: dict = None):
+        self._send(status, json.dumps(obj).encode("utf-8"), headers)
+
+    def _body(self) -> bytes:
+        n = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(n) if n else b""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        srv = self.server
+
+        if url.path.startswith("/files/"):
+            srv.hit("files")
+            path = srv.assets.get(url.path[len("/files/"):])
+            if path is None:
+                return self._send(404)
+            with open(path, "rb") as f:
+                return self._send(200, f.read(), content_type="application/octet-stream")
+
+        if url.path == "/suno/api/v1/generate/record-info":
+            srv.hit("suno.record_info")
+            task_id = parse_qs(url.query).get("taskId", [""])[0]
+            with srv.lock:
+                ready_at = srv.tasks.get(task_id)
+            if ready_at is None:
+                return self._json(404, {"code": 404})
+            status = "SUCCESS" if time.time() >= ready_at else "PENDING"
+            return self._json(200, {"data": {
+                "status": status,
+                "response": {"sunoData": [{"audioUrl": f"{srv.base_url}/files/bgm.mp3"}]},
+            }})
+
+        self._send(404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        srv = self.server
+        body = self._body()
+
+        if url.path == "/suno/api/v1/generate":
+            # Suno answers at once; the task "renders" for the configured latency
+            with srv.lock:
+                srv.calls["suno.generate"] = srv.calls.get("suno.generate", 0) + 1
+                failed = srv.rng.random() < srv.fail["suno"]
+                if failed:
+                    srv.injected["suno.generate"] = srv.injected.get("suno.generate", 0) + 1
+            if failed:
+                return self._json(500, {"code": 500, "msg": "injected failure"})
+            task_id = uuid.uuid4().hex
+            with srv.lock:
+                srv.tasks[task_id] = time.time() + srv.latency["suno"]
+            # like Suno, push the result to the callback once the task is done
+            callback_url = json.loads(body or b"{}").get("callBackUrl") or ""
+            if callback_url.startswith("http://127.0.0.1"):
+                timer = threading.Timer(srv.latency["suno"], srv.post_callback, (callback_url, task_id))
+                timer.daemon = True
+                timer.start()
+            return self._json(200, {"code": 200, "data": {"taskId": task_id}})
+
+        if url.path == "/youtube/upload":
+            if srv.hit("youtube.start", "youtube"):
+                return self._json(503, {"error": "injected failure"})
+            session_id = uuid.uuid4().hex
+            with srv.lock:
+                srv.uploads[session_id] = {
+                    "total": int(self.headers.get("X-Upload-Content-Length") or 0),
+                    "received": 0,
+                    "meta": json.loads(body or b"{}"),
+                }
+            return self._send(200, headers={"Location": f"{srv.base_url}/youtube/session/{session_id}"})
+
+        if url.path == "/tiktok/v2/post/publish/inbox/video/init/":
+            if srv.hit("tiktok.init", "tiktok"):
+                return self._json(500, {"error": {"code": "internal_error", "message": "injected failure"}})
+            source = json.loads(body or b"{}").get("source_info", {})
+            publish_id = f"v_inbox_file~fake.{uuid.uuid4().hex[:12]}"
+            with srv.lock:
+                srv.tiktok_uploads[publish_id] = {"total": int(source.get("video_size") or 0), "received": 0}
+            return self._json(200, {
+                "data": {"publish_id": publish_id, "upload_url": f"{srv.base_url}/tiktok/upload/{publish_id}"},
+                "error": {"code": "ok", "message": ""},
+            })
+
+        self._send(404)
+
+    def do_PUT(self):
+        url = urlparse(self.path)
+        srv = self.server
+        body = self._body()
+
+        if url.path.startswith("/tiktok/upload/"):
+            return self._tiktok_chunk(url.path.rsplit("/", 1)[1], body)
+        if not url.path.startswith("/youtube/session/"):
+            return self._send(404)
+        with srv.lock:
+            upload = srv.uploads.get(url.path.rsplit("/", 1)[1])
+        if upload is None:
+            return self._send(404)
+
+        rng = self.headers.get("Content-Range", "")
+        if not rng.startswith("bytes */"):
+            if srv.hit("youtube.chunk", "youtube"):
+                return self._json(503, {"error": "injected failure"})
+            m = re.match(r"bytes (\d+)-(\d+)/(\d+)", rng)
+            if m and int(m.group(1)) == upload["received"]:
+                upload["received"] += len(body)
+
+        if upload["received"] >= upload["total"]:
+            return self._json(200, {"id": f"fake-{uuid.uuid4().hex[:11]}"})
+        headers = {"Range": f"bytes=0-{upload['received'] - 1}"} if upload["received"] else {}
+        self._send(308, headers=headers)
+
+    def _tiktok_chunk(self, publish_id: str, body: bytes):
+        srv = self.server
+        with srv.lock:
+            upload = srv.tiktok_uploads.get(publish_id)
+        if upload is None:
+            return self._send(404)
+        if srv.hit("tiktok.chunk", "tiktok"):
+            return self._json(503, {"error": {"code": "internal_error", "message": "injected failure"}})
+
+        m = re.match(r"bytes (\d+)-(\d+)/(\d+)", self.headers.get("Content-Range", ""))
+        if m is None or int(m.group(1)) != upload["received"]:
+            return self._json(416, {"error": {"code": "range_mismatch", "message": "unexpected chunk"}})
+        upload["received"] += len(body)
+        self._send(201 if upload["received"] >= upload["total"] else 206)
+
+
+class _FakeFileOutput:
+    # mimics replicate.helpers.FileOutput: download_to streams from .url
+    def __init__(self, url: str):
+        self.url = url
+
+
+class StubLLM:
+    """
+    Local stand-in for the dataset model: returns well-formed JSON built from
+    word lists, including some plural/reordered near-duplicates so the
+    dedupe path gets exercised. Deterministic for a given seed.
+    """
+
+    ROLES = ["baker", "pilot", "librarian", "firefighter", "gardener", "detective",
+             "plumber", "astronaut", "surgeon", "lifeguard", "barista", "tailor"]
+    MODIFIERS = ["", "street", "night", "mountain", "deep sea", "circus", "museum", "royal"]
+    ANIMALS = ["fox", "owl", "bear", "otter", "penguin", "cat", "dog", "rabbit", "eagle", "turtle"]
+
+    def __init__(self, seed: int = 0, latency: float = 0.0):
+        self._rng = random.Random(seed)
+        self.latency = latency
+        self.calls = 0
+
+    def __call__(self, prompt: str) -> str:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        count = int(re.search(r"EXACTLY (\d+)", prompt).group(1))
+
+        out = {}
+        while len(out) < count:
+            job = f"{self._rng.choice(self.MODIFIERS)} {self._rng.choice(self.ROLES)}".strip()
+            if self._rng.random() < 0.2:
+                job += "s"
+            out[job] = {"animals": self._rng.sample(self.ANIMALS, 3), "used": False}
+        return json.dumps(out)
+
+
+def _install_fakes(config: dict):
+    """
+    Swap the in-process provider entry points (replicate.run, OpenAI,
+    the YouTube client, Suno/YouTube base URLs) for local stand-ins before
+    make_video.py imports them.
+    """
+    import functools
+    import types
+    import openai
+    import replicate
+    import requests
+    import utils.bgm
+    import utils.upload
+
+    base = config["base_url"]
+    latency, fail = config["latency"], config["fail"]
+    rng = random.Random(config["seed"])
+    lock = threading.Lock()
+
+    def _inject(provider: str):
+        time.sleep(latency[provider])
+        with lock:
+            failed = rng.random() < fail[provider]
+        if failed:
+            raise RuntimeError(f"[Fake] injected {provider} failure")
+
+    def fake_run(model, input=None, **kwargs):
+        _inject("replicate")
+        if "image" in (input or {}):
+            return _FakeFileOutput(f"{base}/files/clip.mp4")
+        return [_FakeFileOutput(f"{base}/files/image.jpg")]
+
+    llm = StubLLM(seed=config["seed"])
+
+    class FakeOpenAI:
+        def __init__(self, *args, **kwargs):
+            self.responses = types.SimpleNamespace(create=self._create)
+
+        def _create(self, model=None, input=None, **kwargs):
+            _inject("openai")
+            return types.SimpleNamespace(output_text=llm(input))
+
+    replicate.run = fake_run
+    openai.OpenAI = FakeOpenAI
+    utils.upload.get_youtube_client = lambda: types.SimpleNamespace(session=requests.Session())
+    utils.upload.upload_to_youtube = functools.partial(
+        utils.upload.upload_to_youtube, upload_url=f"{base}/youtube/upload"
+    )
+    utils.bgm.generate_bgm = functools.partial(
+        utils.bgm.generate_bgm, api_base=f"{base}/suno", poll_initial=0.2, poll_max=1.0
+    )
+
+def _pipeline_worker(config: dict):
+    import runpy
+
+    _install_fakes(config)
+    sys.argv = ["make_video.py"] + config["argv"]
+    try:
+        runpy.run_module("make_video", run_name="__main__")
+    except SystemExit as e:
+        return e.code or 0
+    return 0
+
+def run_pipeline(config: dict) -> dict:
+    """
+    Run make_video.py in a child process with the fakes installed, so the
+    measurements cover exactly the pipeline (fake HTTP providers stay in
+    this process and are not counted).
+    """
+    cmd = [sys.executable, "-m", "benchmarks.pipeline", "--worker", json.dumps(config)]
+    return run_child(cmd)
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def count_finished(output_dir: str) -> int:
+    n = 0
+    for path in glob.glob(os.path.join(output_dir, "*", "manifest.json")):
+        with open(path, "r", encoding="utf-8") as f:
+            if json.load(f).get("status") == "done":
+                n += 1
+    return n
+
+def print_report(totals: dict, stages: list):
+    print(f"{'stage':<24}{'count':>7}{'errors':>8}{'total':>10}{'mean':>9}{'p95':>9}{'cpu':>9}{'child cpu':>11}")
+    for r in stages:
+        print(
+            f"{r['name']:<24}{r['count']:>7}{r['errors']:>8}{r['total_s']:>9.1f}s"
+            f"{r['mean_s']:>8.2f}s{r['p95_s']:>8.2f}s{r['cpu_s']:>8.1f}s{r['child_cpu_s']:>10.1f}s"
+        )
+    print()
+    print(
+        f"[Bench] {totals['jobs_ok']}/{totals['jobs']} jobs in {totals['wall_s']:.1f}s wall, "
+        f"{totals['cpu_s']:.1f}s cpu, peak tree RSS {totals['peak_tree_rss_mb']:.0f} MB, "
+        f"{totals['jobs_per_hour']:.1f} jobs/hour"
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--worker", type=str, default=None)
+    parser.add_argument("--jobs", type=int, default=3)
+    parser.add_argument("--latency", type=str, default="replicate=2,suno=4,openai=0.5,youtube=0.1,tiktok=0.1")
+    parser.add_argument("--fail", type=str, default="")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bench_dir", type=str, default="./bench_output/pipeline")
+    parser.add_argument("--report", type=str, default=None)
+    parser.add_argument("--no_callback", action="store_true")
+    # anything else is passed through to make_video.py (e.g. --renderer ffmpeg --lookahead 1)
+    args, passthrough = parser.parse_known_args()
+
+    if args.worker is not None:
+        sys.exit(_pipeline_worker(json.loads(args.worker)))
+
+    latency = parse_provider_map(args.latency)
+    fail = parse_provider_map(args.fail)
+
+    # fresh run state every time; the synthetic assets are kept
+    bench_dir = os.path.abspath(args.bench_dir)
+    for sub in ("data", "output", "cache", "trace"):
+        shutil.rmtree(os.path.join(bench_dir, sub), ignore_errors=True)
+    data_dir = os.path.join(bench_dir, "data")
+    os.makedirs(data_dir)
+    with open(os.path.join(data_dir, "keys.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "OPENAI_API_KEY": "fake",
+            "REPLICATE_API_TOKEN": "fake",
+            "SUNO_API_KEY": "fake",
+            "TIKTOK_ACCESS_TOKEN": "fake",
+        }, f)
+
+    print("[Bench] preparing synthetic assets")
+    assets = make_assets(os.path.join(bench_dir, "assets"))
+    server = FakeProviderServer(assets, latency, fail, seed=args.seed).start()
+
+    trace_path = os.path.join(bench_dir, "trace", "trace.jsonl")
+    argv = [
+        "--data_path", data_dir,
+        "--output_path", os.path.join(bench_dir, "output"),
+        "--cache_path", os.path.join(bench_dir, "cache"),
+        "--limits_db", os.path.join(data_dir, "provider_limits.db"),
+        "--trace_path", trace_path,
+        "--prom_path", os.path.join(bench_dir, "trace", "pipeline.prom"),
+        "--batch", str(args.jobs),
+        # only used with a passed-through --tiktok
+        "--tiktok_api_base", f"{server.base_url}/tiktok",
+    ]
+    if not args.no_callback:
+        # exercise the callback receiver; record-info polling stays as the fallback
+        port = _free_port()
+        argv += [
+            "--suno_callback_url", f"http://127.0.0.1:{port}",
+            "--suno_callback_port", str(port),
+        ]
+    argv += passthrough
+    config = {
+        "base_url": server.base_url,
+        "latency": latency,
+        "fail": fail,
+        "seed": args.seed,
+        "argv": argv,
+    }
+
+    print(f"[Bench] running {args.jobs} jobs against fake providers at {server.base_url}")
+    try:
+        totals = run_pipeline(config)
+    finally:
+        server.close()
+
+    jobs_ok = count_finished(os.path.join(bench_dir, "output"))
+    totals.update(
+        jobs=args.jobs,
+        jobs_ok=jobs_ok,
+        jobs_per_hour=jobs_ok / totals["wall_s"] * 3600 if totals["wall_s"] > 0 else 0.0,
+    )
+    stages = summarize(trace_path) if os.path.exists(trace_path) else []
+    print_report(totals, stages)
+
+    report_path = args.report or os.path.join(bench_dir, "pipeline.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "latency": latency,
+                "fail": fail,
+                "make_video_args": passthrough,
+                "totals": totals,
+                "stages": stages,
+                "provider_calls": server.calls,
+                "injected_failures": server.injected,
+            },
+            f,
+            indent=4,
+        )
+    print(f"[Bench] report saved to: {report_path}")
@@ -0,0 +1,206 @@
+import os
+import re
+import sys
+import json
+import argparse
+import itertools
+import subprocess
+
+from utils.utils import sanitize_file_name
+from utils.manifest import MANIFEST_NAME
+from utils.memory import run_child
+from utils.store import open_store
+
+
+def find_inputs(output_dir: str, job: str = None, data_file: str = None):
+    """
+    Job, animals (in the order make_video.py rendered them) and the per-animal
+    mp4s + BGM of one job folder. The order comes from the job's manifest,
+    or from the dataset for folders made before manifests existed, so caption
+    numbering and the intro clip match the real short.
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        job, animals = manifest["job"], manifest["animals"]
+    elif data_file is not None and job is not None:
+        data = open_store(data_file)
+        try:
+            entry = dict(data.items()).get(job)
+        finally:
+            data.close()
+        if entry is None:
+            raise RuntimeError(f"'{job}' is not in {data_file}")
+        animals = entry["animals"]
+    else:
+        raise RuntimeError(f"no {MANIFEST_NAME} in {output_dir}; pass --job and --data_file")
+
+    job_s = sanitize_file_name(job)
+    video_paths = [
+        os.path.join(output_dir, f"{job_s}_{sanitize_file_name(animal)}.mp4")
+        for animal in animals
+    ]
+    missing = [p for p in video_paths if not os.path.exists(p)]
+    if missing:
+        raise RuntimeError(f"missing per-animal mp4s: {missing}")
+
+    bgm_path = os.path.join(output_dir, f"{job_s}_bgm.mp3")
+    if not os.path.exists(bgm_path):
+        raise RuntimeError(f"missing BGM: {bgm_path}")
+    return job, animals, video_paths, bgm_path
+
+def _render_worker(config: dict):
+    from utils.render import (
+        prepare_ffmpeg_inputs,
+        render_with_ffmpeg,
+        render_with_moviepy,
+    )
+
+    encode = {k: config[k] for k in ("fps", "preset", "threads", "crf")}
+    if config["renderer"] == "ffmpeg":
+        intro_image_path, caption_paths, probes, _ = prepare_ffmpeg_inputs(
+            config["job"], config["animals"], config["video_paths"], config["work_dir"]
+        )
+        render_with_ffmpeg(
+            intro_image_path,
+            config["intro_sec"],
+            config["video_paths"],
+            caption_paths,
+            probes,
+            config["bgm_path"],
+            config["out_path"],
+            **encode,
+        )
+    else:
+        render_with_moviepy(
+            config["job"],
+            config["animals"],
+            config["video_paths"],
+            config["bgm_path"],
+            config["out_path"],
+            intro_sec=config["intro_sec"],
+            **encode,
+        )
+
+def run_config(config: dict) -> dict:
+    """
+    Render one configuration in a child process so the measurements cover
+    exactly that render.
+    """
+    cmd = [sys.executable, "-m", "benchmarks.render_settings", "--worker", json.dumps(config)]
+    result = run_child(cmd)
+    exit_code = result.pop("exit_code")
+    if exit_code != 0:
+        raise RuntimeError(f"render failed for {config['label']} (exit {exit_code})")
+    result["size_mb"] = os.path.getsize(config["out_path"]) / 1024 ** 2
+    return result
+
+def compare_quality(path: str, reference_path: str) -> dict:
+    cmd = [
+        "ffmpeg", "-hide_banner", "-nostats",
+        "-i", path, "-i", reference_path,
+        "-filter_complex", "[0:v]split[a0][a1];[1:v]split[b0][b1];[a0][b0]ssim;[a1][b1]psnr",
+        "-f", "null", "-",
+    ]
+    err = subprocess.run(cmd, check=True, capture_output=True, text=True).stderr
+    ssim = re.search(r"SSIM .*All:([\d.]+)", err)
+    psnr = re.search(r"PSNR .*average:([\d.]+|inf)", err)
+    return {
+        "ssim": float(ssim.group(1)) if ssim else None,
+        "psnr": float(psnr.group(1)) if psnr else None,
+    }
+
+def print_table(rows: list):
+    header = f"{'config':<28}{'wall(s)':>9}{'cpu(s)':>9}{'tree rss(MB)':>14}{'size(MB)':>10}{'psnr':>8}{'ssim':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        psnr = f"{r['psnr']:.2f}" if r.get("psnr") is not None else "-"
+        ssim = f"{r['ssim']:.4f}" if r.get("ssim") is not None else "-"
+        print(
+            f"{r['label']:<28}{r['wall_s']:>9.1f}{r['cpu_s']:>9.1f}"
+            f"{r['peak_tree_rss_mb']:>14.0f}{r['size_mb']:>10.2f}{psnr:>8}{ssim:>8}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--worker", type=str, default=None)
+    parser.add_argument("--output_dir", type=str, default=None)
+    parser.add_argument("--job", type=str, default=None)
+    parser.add_argument("--data_file", type=str, default=None)
+    parser.add_argument("--renderer", type=str, choices=["moviepy", "ffmpeg"], default="ffmpeg")
+    parser.add_argument("--presets", type=str, default="ultrafast,veryfast,medium")
+    parser.add_argument("--threads", type=str, default="2,4,8")
+    parser.add_argument("--crfs", type=str, default="18,23,28")
+    parser.add_argument("--fps", type=int, default=24)
+    parser.add_argument("--reference_preset", type=str, default="slow")
+    parser.add_argument("--reference_crf", type=int, default=12)
+    parser.add_argument("--bench_dir", type=str, default="./bench_output")
+    parser.add_argument("--report", type=str, default="./bench_output/render_settings.json")
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        _render_worker(json.loads(args.worker))
+        sys.exit(0)
+
+    if args.output_dir is None:
+        parser.error("--output_dir is required")
+
+    job, animals, video_paths, bgm_path = find_inputs(args.output_dir, args.job, args.data_file)
+    os.makedirs(args.bench_dir, exist_ok=True)
+
+    base = {
+        "renderer": args.renderer,
+        "job": job,
+        "animals": animals,
+        "video_paths": video_paths,
+        "bgm_path": bgm_path,
+        "intro_sec": 1.0,
+        "fps": args.fps,
+        "work_dir": os.path.join(args.bench_dir, "inputs"),
+    }
+
+    reference = dict(
+        base,
+        label="reference",
+        preset=args.reference_preset,
+        threads=os.cpu_count() or 4,
+        crf=args.reference_crf,
+        out_path=os.path.join(args.bench_dir, "reference.mp4"),
+    )
+    print(f"[Bench] rendering reference ({args.reference_preset}, crf {args.reference_crf})")
+    run_config(reference)
+
+    rows = []
+    matrix = itertools.product(
+        args.presets.split(","),
+        [int(t) for t in args.threads.split(",")],
+        [int(c) for c in args.crfs.split(",")],
+    )
+    for preset, threads, crf in matrix:
+        label = f"{preset}/t{threads}/crf{crf}"
+        config = dict(
+            base,
+            label=label,
+            preset=preset,
+            threads=threads,
+            crf=crf,
+            out_path=os.path.join(args.bench_dir, f"{preset}_t{threads}_crf{crf}.mp4"),
+        )
+        print(f"[Bench] {label}")
+        row = {"label": label, "preset": preset, "threads": threads, "crf": crf}
+        row.update(run_config(config))
+        row.update(compare_quality(config["out_path"], reference["out_path"]))
+        rows.append(row)
+
+    print_table(rows)
+
+    os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(
+            {"renderer": args.renderer, "job": job, "fps": args.fps, "results": rows},
+            f,
+            indent=4,
+        )
+    print(f"[Bench] report saved to: {args.report}")
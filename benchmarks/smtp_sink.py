@@ -0,0 +1,78 @@
+import time
+import argparse
+import threading
+import socketserver
+
+
+class _SinkHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line: str):
+        self.wfile.write((line + "\r\n").encode("utf-8"))
+
+    def handle(self):
+        self._reply("220 smtp sink ready")
+        in_data, lines = False, []
+        for raw in self.rfile:
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            if in_data:
+                if line == ".":
+                    in_data = False
+                    self.server.messages.append("\n".join(lines))
+                    lines = []
+                    self._reply("250 OK")
+                else:
+                    lines.append(line[1:] if line.startswith("..") else line)
+                continue
+
+            verb = line[:4].upper()
+            if verb in ("HELO", "EHLO"):
+                self._reply("250 smtp sink")
+            elif verb == "DATA":
+                in_data = True
+                self._reply("354 end with <CRLF>.<CRLF>")
+            elif verb == "QUIT":
+                self._reply("221 bye")
+                break
+            else:  # MAIL, RCPT, RSET, NOOP
+                self._reply("250 OK")
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """
+    Minimal local SMTP stand-in that accepts everything and keeps the raw
+    messages in `.messages` (no TLS, no auth). For exercising the sender.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 1025):
+        super().__init__((host, port), _SinkHandler)
+        self.messages = []
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="smtp-sink", daemon=True).start()
+        return self
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    # e.g. python -m utils.notify flush --smtp_host 127.0.0.1 --smtp_port 1025 (needs ALERT_EMAIL in keys.json)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=1025)
+    args = parser.parse_args()
+
+    sink = SmtpSink(port=args.port)
+    print(f"[Alert] SMTP sink listening on 127.0.0.1:{args.port}")
+    n = 0
+    sink.start()
+    try:
+        while True:
+            time.sleep(0.5)
+            for msg in sink.messages[n:]:
+                print(msg + "\n" + "-" * 40)
+            n = len(sink.messages)
+    except KeyboardInterrupt:
+        sink.close()
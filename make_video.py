@@ -2,67 +2,396 @@ import os
 import json
 import argparse
 import random
+import sys
 import time
-from moviepy import VideoFileClip, AudioFileClip, concatenate_videoclips
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 
 from utils.utils import sanitize_file_name, find_unused_pair
-from utils.bgm import generate_bgm, loop_or_trim_audio_to_duration
-from utils.video import generate_image, generate_video, make_intro, overlay_top_caption
-from utils.upload import upload_to_youtube
-from utils.notify import notify_crash
-
-DATA_PROMPT = """You are helping me build a dataset for generative video creation.
-
-Task:
-- Generate EXACTLY 10 unique jobs.
-- For each job, list 3–4 animals that would be visually and conceptually suitable for that job.
-- Jobs must be imaginative but still easy to recognize visually in a short video.
-- Animals should make intuitive sense for the job (based on behavior, stereotypes, or symbolism).
-
-Constraints:
-- DO NOT reuse or paraphrase any of the following existing jobs:
-{existing_jobs}
-
-- Each job must be a single noun phrase (e.g., "firefighter", "librarian", "street photographer").
-- Animals must be common, recognizable animals (no mythical creatures).
-
-Output format:
-Return ONLY valid JSON in the following structure:
+from utils.bgm import generate_bgm, validate_audio, bgm_key
+from utils.video import ensure_image, ensure_video, image_key, video_key, probe_video, VIDEO_PARAMS
+from utils.render import (
+    render_timer,
+    prepare_ffmpeg_inputs,
+    render_with_ffmpeg,
+    render_with_moviepy,
+    render_segmented,
+    render_preview,
+    contact_sheet,
+)
+from utils.stream import render_with_stream
+from utils.memory import (
+    configure_memory,
+    memory_watch,
+    tree_rss_bytes,
+    estimate_render_mb,
+    choose_render_strategy,
+    MemoryProfile,
+    MB,
+)
+from utils.cache import AssetCache
+from utils.download import is_valid
+from utils.manifest import JobManifest, run_stage, inputs_hash, find_in_progress, MAX_RESUME_FAILURES
+from utils.trace import configure_tracing, span
+from utils.scheduler import (
+    StageScheduler,
+    with_priority,
+    configure_limits,
+    print_metrics,
+    DEFAULT_LIMITS_DB,
+)
+from utils.store import open_store, import_json
+from utils.callback import SunoCallbackServer
+from utils.upload import get_youtube_client, upload_to_youtube, upload_to_tiktok_inbox_draft, TIKTOK_OPEN_API
+from utils.publish import publish_concurrently
+from utils.notify import notify_crash, configure_alerts, shutdown_alerts, smtp_config
+from utils.dataset import create_data, openai_llm, Replenisher
+
+def load_keys(data_path):
+    api_path = f"{data_path}/keys.json"
+    with open(api_path, "r", encoding="utf-8") as f:
+        keys = json.load(f)
+
+    for k in ["OPENAI_API_KEY", "REPLICATE_API_TOKEN", "SUNO_API_KEY"]:
+        if k not in keys:
+            raise RuntimeError(f"{k} is missing in keys.json")
+
+    os.environ["OPENAI_API_KEY"] = keys["OPENAI_API_KEY"]
+    os.environ["REPLICATE_API_TOKEN"] = keys["REPLICATE_API_TOKEN"]
+    os.environ["SUNO_API_KEY"] = keys["SUNO_API_KEY"]
+    return keys
+
+def load_data(data_dir, concept, backend="json"):
+    """
+    Open the dataset store. The first sqlite run imports the existing
+    `{concept}.json` so the two stay interchangeable.
+    """
+    json_path = f"{data_dir}/{concept}.json"
+    if backend != "sqlite":
+        return json_path, open_store(json_path)
+
+    db_path = f"{data_dir}/{concept}.db"
+    if not os.path.exists(db_path) and os.path.exists(json_path):
+        n = import_json(json_path, db_path)
+        print(f"[DATA] imported {n} jobs from {json_path}")
+    return db_path, open_store(db_path)
+
+def pick_job(
+    llm, data, category=None, exclude=(), output_root=None, replenisher=None, max_failures=MAX_RESUME_FAILURES
+):
+    unused_pairs = [p for p in find_unused_pair(data) if p[0] not in exclude]
+
+    # an interrupted job keeps its paid-for assets, so finish it before starting a new one
+    if category is None and output_root is not None:
+        unused = {j for j, _ in unused_pairs}
+        for job, animals in find_in_progress(output_root, max_failures):
+            if job in unused:
+                print(f"[Resume] continuing in-progress job '{job}'")
+                return job, animals
+
+    if not unused_pairs:
+        if replenisher is not None:
+            print("[DATA] waiting for the replenisher")
+            replenisher.wait_for_unused()
+        else:
+            create_data(llm, data)
+        unused_pairs = [p for p in find_unused_pair(data) if p[0] not in exclude]
+
+    if category is not None:
+        job = category.replace("_", " ")
+        for _job, _animals in unused_pairs:
+            if job == _job:
+                return _job, _animals
+        raise RuntimeError(f"'{job}' does not exist in unused pair.")
+
+    if not unused_pairs:
+        raise RuntimeError("no unused job left after dataset generation")
+    return random.choice(unused_pairs)
+
+INTRO_SEC = 1.0
+
+def ensure_bgm(job, duration, output_path, cache=None, suno_callback=None):
+    job_s = sanitize_file_name(job)
+    bgm_path = os.path.join(output_path, f"{job_s}_bgm.mp3")
+    if cache is not None or not is_valid(bgm_path, validate_audio):
+        generated = generate_bgm(
+            job=job,
+            duration=int(duration),
+            audio_path=bgm_path,
+            cache=cache,
+            callback=suno_callback,
+        )
+        if generated:
+            time.sleep(2.0)
+    return bgm_path
+
+def _video_stage(manifest, job, animal, image_path, output_path, cache=None):
+    # the inputs hash needs the finished image, so it is taken inside the stage
+    return run_stage(
+        manifest, f"video:{animal}",
+        ensure_video, job, animal, image_path, output_path, cache,
+        inputs=video_key(job, animal, image_path),
+    )
 
-{{
-  "job_name": {{
-    "animals": ["animal_1", "animal_2", ...],
-    "used": false
-  }}
-}}
+def submit_assets(
+    scheduler, job, animals, output_path, cache=None, suno_callback=None, manifest=None, foreground=None
+):
+    """
+    Queue every provider stage of one job: image -> video per animal, and the
+    BGM (sized from the requested clip length) alongside them. With a
+    `foreground` event, the stages only use non-reserved provider slots
+    until it is set (prefetched jobs).
+    Each checkpoint records the asset key of its stage (prompt, model and
+    params, plus the image hash for videos), so a changed prompt or a
+    regenerated image invalidates everything built from it.
+    Returns (video_futures, bgm_future), videos in `animals` order.
+    """
+    stage, video_stage = run_stage, _video_stage
+    if foreground is not None:
+        stage, video_stage = with_priority(foreground, run_stage), with_priority(foreground, _video_stage)
+
+    video_futures = []
+    for animal in animals:
+        image = scheduler.submit(
+            f"{job}/image:{animal}",
+            stage, manifest, f"image:{animal}",
+            ensure_image, job, animal, output_path, cache,
+            inputs=image_key(job, animal),
+        )
+        video = scheduler.submit(
+            f"{job}/video:{animal}",
+            video_stage, manifest, job, animal, image, output_path, cache,
+        )
+        video_futures.append(video)
+
+    duration = INTRO_SEC + VIDEO_PARAMS["duration"] * len(animals)
+    bgm_future = scheduler.submit(
+        f"{job}/bgm",
+        stage, manifest, "bgm",
+        ensure_bgm, job, duration, output_path, cache, suno_callback,
+        inputs=bgm_key(job, int(duration)),
+    )
+    return video_futures, bgm_future
+
+def render_short(
+    job,
+    animals,
+    output_path,
+    max_workers=4,
+    cache=None,
+    suno_callback=None,
+    renderer="moviepy",
+    encode=None,
+    scheduler=None,
+    manifest=None,
+    assets=None,
+    preview=False,
+    memory_budget_mb=None,
+    memory_profile=None,
+):
+    encode = encode or {}
+    job_s = sanitize_file_name(job)
+
+    own_scheduler = scheduler is None and assets is None
+    if own_scheduler:
+        scheduler = StageScheduler(max_workers=max_workers + 1)
+
+    # generate images/videos/bgm (unless already submitted by a prefetch)
+    try:
+        if assets is None:
+            assets = submit_assets(
+                scheduler,
+                job,
+                animals,
+                output_path,
+                cache=cache,
+                suno_callback=suno_callback,
+                manifest=manifest,
+            )
+        video_futures, bgm_future = assets
+        video_paths = [f.result() for f in video_futures]
+        bgm_path = bgm_future.result()
+    finally:
+        if own_scheduler:
+            scheduler.shutdown()
+
+    if preview:
+        return _render_preview(job, animals, video_paths, bgm_path, output_path)
+
+    final_path = os.path.join(output_path, f"{job_s}_final.mp4")
+    render_inputs = inputs_hash(*video_paths, bgm_path, renderer, encode)
+    return run_stage(
+        manifest,
+        "render",
+        _render_final,
+        job,
+        animals,
+        video_paths,
+        bgm_path,
+        final_path,
+        output_path,
+        renderer,
+        encode,
+        memory_budget_mb,
+        memory_profile,
+        inputs=render_inputs,
+    )
 
-- Use lowercase for all job and animal names.
-- Do not include any explanations, comments, or extra text.
-"""
+def _render_final(
+    job, animals, video_paths, bgm_path, final_path, output_path, renderer, encode,
+    memory_budget_mb=None, memory_profile=None,
+):
+    estimated_mb = None
+    if memory_budget_mb is not None or memory_profile is not None:
+        probes = [probe_video(vp) for vp in video_paths]
+        renderer, encode, _ = choose_render_strategy(
+            renderer, probes, encode, memory_budget_mb, memory_profile
+        )
+        estimated_mb = estimate_render_mb(renderer, probes, encode)
+
+    base_mb = tree_rss_bytes() / MB
+    with render_timer(renderer), memory_watch() as mem:
+        if renderer in ("ffmpeg", "segments"):
+            intro_image_path, caption_paths, probes, fps = prepare_ffmpeg_inputs(
+                job, animals, video_paths, os.path.join(output_path, "ffmpeg_inputs")
+            )
+            render = render_segmented if renderer == "segments" else render_with_ffmpeg
+            render(
+                intro_image_path,
+                INTRO_SEC,
+                video_paths,
+                caption_paths,
+                probes,
+                bgm_path,
+                final_path,
+                **encode,
+            )
+        elif renderer == "stream":
+            render_with_stream(
+                job,
+                animals,
+                video_paths,
+                bgm_path,
+                final_path,
+                intro_sec=INTRO_SEC,
+                intro_cache_dir=output_path,
+                **encode,
+            )
+        else:
+            render_with_moviepy(
+                job,
+                animals,
+                video_paths,
+                bgm_path,
+                final_path,
+                intro_sec=INTRO_SEC,
+                intro_cache_dir=output_path,
+                **encode,
+            )
+
+    if mem:
+        print(f"[Memory] {renderer} render peak {mem['tree_rss_peak_mb']:.0f} MB (process tree)")
+        if memory_profile is not None and estimated_mb:
+            memory_profile.record(renderer, estimated_mb, max(0.0, mem["tree_rss_peak_mb"] - base_mb))
+    return final_path
+
+def _render_preview(job, animals, video_paths, bgm_path, output_path):
+    """
+    Low-res draft plus one contact sheet per segment; not checkpointed, so a
+    later full render of the same job is unaffected.
+    """
+    preview_dir = os.path.join(output_path, "preview")
+    preview_path = os.path.join(preview_dir, f"{sanitize_file_name(job)}_preview.mp4")
+    os.makedirs(preview_dir, exist_ok=True)
+
+    with render_timer("preview"):
+        intro_image_path, caption_paths, probes, _ = prepare_ffmpeg_inputs(
+            job, animals, video_paths, os.path.join(output_path, "ffmpeg_inputs")
+        )
+        segments = render_preview(
+            intro_image_path,
+            INTRO_SEC,
+            video_paths,
+            caption_paths,
+            probes,
+            bgm_path,
+            preview_path,
+        )
+        for idx, (start, duration) in enumerate(segments):
+            name = "intro" if idx == 0 else sanitize_file_name(animals[idx - 1])
+            sheet = contact_sheet(preview_path, start, duration, os.path.join(preview_dir, f"sheet_{idx}_{name}.jpg"))
+            print(f"[Preview] contact sheet: {sheet}")
+
+    print(f"[Preview] draft: {preview_path}")
+    return preview_path
+
+def publish_short(job, final_path, manifest, upload_chunk_mb=8, tiktok_token=None, tiktok_api_base=TIKTOK_OPEN_API):
+    """
+    Upload the final mp4 to every enabled platform at once. Each platform is
+    its own manifest stage, so a rerun only retries the ones that failed.
+    """
+    render_sha = manifest.get("render").get("sha256")
+    title = f"What it ____ was a {job}"
+    description = f"AI-generated animal {job}"
+
+    def _already(stage):
+        entry = manifest.get(stage)
+        if entry.get("status") == "done" and entry.get("inputs") == render_sha:
+            print(f"[Resume] {stage} already published: {entry['publish_id']}")
+            return True
+        return False
+
+    def _youtube():
+        manifest.start("upload")
+        video_id = upload_to_youtube(
+            file_path=final_path,
+            title=title,
+            description=description,
+            tags=["ai", "animals", "shorts", job],
+            privacy_status="private",
+            session=get_youtube_client().session,
+            chunk_size_mb=upload_chunk_mb,
+        )
+        manifest.complete("upload", inputs=render_sha, publish_id=video_id)
+        print(f"[Youtube] Uploaded: {video_id}")
+        return video_id
 
-def create_data(client, data):
-    existing_jobs = list(data.keys())
+    def _tiktok():
+        manifest.start("tiktok")
+        publish_id = upload_to_tiktok_inbox_draft(final_path, access_token=tiktok_token, api_base=tiktok_api_base)
+        manifest.complete("tiktok", inputs=render_sha, publish_id=publish_id)
+        return publish_id
 
-    prompt = DATA_PROMPT.format(
-        existing_jobs=", ".join(existing_jobs) if existing_jobs else "none"
-    )
+    uploads = {}
+    if not _already("upload"):
+        uploads["youtube"] = _youtube
+    if tiktok_token and not _already("tiktok"):
+        uploads["tiktok"] = _tiktok
 
-    response = client.responses.create(
-        model="gpt-5-nano",
-        input=prompt,
-    )
+    if uploads:
+        publish_concurrently(uploads)
 
+def report_crash(exc, context):
+    # spooled to disk right away; the background sender emails it
     try:
-        raw = response.output_text.strip()
-        raw = raw[raw.find("{"): raw.rfind("}") + 1]
-        new_data = json.loads(raw)
-    except json.JSONDecodeError as e:
-        raise RuntimeError(
-            f"Failed to parse JSON from model output:\n{response.output_text}"
-        ) from e
-
-    data.update(new_data)
+        path = notify_crash(exc, context)
+        print(f"[Alert] crash spooled: {path}")
+    except Exception as spool_err:
+        print(f"[WARN] failed to spool crash alert: {spool_err}")
+
+def print_summary(results, elapsed):
+    ok = [r for r in results if r["ok"]]
+    failed = [r for r in results if not r["ok"]]
+
+    print(f"[Batch] {len(ok)} succeeded, {len(failed)} failed in {elapsed:.1f}s")
+    for r in results:
+        status = "ok" if r["ok"] else "FAILED"
+        print(f"[Batch]   {r['job']}: {status} ({r['seconds']:.1f}s)")
+    if ok and elapsed > 0:
+        print(f"[Batch] throughput: {len(ok) / elapsed * 3600:.2f} shorts/hour, "
+              f"{elapsed / len(ok):.1f}s per short")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -70,159 +399,310 @@ if __name__ == "__main__":
     parser.add_argument("--output_path", type=str, default="./output")
     parser.add_argument("--concept", type=str, default="animal_with_job")
     parser.add_argument("--category", type=str, default=None)
+    parser.add_argument("--store", type=str, choices=["json", "sqlite"], default="json")
+    parser.add_argument("--max_workers", type=int, default=4)
+    parser.add_argument("--renderer", type=str, choices=["moviepy", "ffmpeg", "stream", "segments"], default="moviepy")
+    parser.add_argument("--fps", type=int, default=24)
+    parser.add_argument("--preset", type=str, default="medium")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--crf", type=int, default=None)
+    parser.add_argument("--stream_workers", type=int, default=None)
+    parser.add_argument("--stream_frames", type=int, default=None)
+    parser.add_argument("--segment_workers", type=int, default=None)
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--lookahead", type=int, default=0)
+    parser.add_argument("--max_resume_failures", type=int, default=MAX_RESUME_FAILURES)
+    parser.add_argument("--low_watermark", type=int, default=0)
+    parser.add_argument("--preview", action="store_true")
+    parser.add_argument("--alert_spool", type=str, default=None)
+    parser.add_argument("--smtp_host", type=str, default=None)
+    parser.add_argument("--smtp_port", type=int, default=None)
+    parser.add_argument("--alert_window", type=float, default=60.0)
+    parser.add_argument("--memory_budget_mb", type=float, default=None)
+    parser.add_argument("--memory_interval", type=float, default=0.1)
+    parser.add_argument("--trace_malloc", action="store_true")
+    parser.add_argument("--all_unused", "--all-unused", action="store_true")
+    parser.add_argument("--cache_path", type=str, default="./cache")
+    parser.add_argument("--cache_max_gb", type=float, default=10.0)
+    parser.add_argument("--no_cache", action="store_true")
+    parser.add_argument("--suno_callback_url", type=str, default=None)
+    parser.add_argument("--suno_callback_port", type=int, default=8765)
+    parser.add_argument("--suno_callback_host", type=str, default="127.0.0.1")
+    parser.add_argument("--suno_callback_secret", type=str, default=None)
+    parser.add_argument("--limits_db", type=str, default=DEFAULT_LIMITS_DB)
+    parser.add_argument("--provider_limits", type=str, default=None)
+    parser.add_argument("--no_limits", action="store_true")
+    parser.add_argument("--upload_chunk_mb", type=float, default=8)
+    parser.add_argument("--tiktok", action="store_true")
+    parser.add_argument("--tiktok_api_base", type=str, default=TIKTOK_OPEN_API)
+    parser.add_argument("--trace_path", type=str, default=None)
+    parser.add_argument("--prom_path", type=str, default=None)
     args = parser.parse_args()
 
     os.makedirs(args.output_path, exist_ok=True)
+    tracer = configure_tracing(
+        args.trace_path or os.path.join(args.output_path, "trace.jsonl"),
+        args.prom_path or os.path.join(args.output_path, "pipeline.prom"),
+    )
+    # every span now also records RSS / tracemalloc peaks
+    monitor = configure_memory(args.memory_interval, trace_python=args.trace_malloc)
+    memory_profile = MemoryProfile(args.output_path)
+
+    single = args.batch <= 1 and not args.all_unused and args.category is None
+    if args.category is not None:
+        limit = 1
+    elif args.all_unused:
+        limit = None
+    else:
+        limit = max(1, args.batch)
 
-    job = None
-    output_path = None
-    final_path = None
-    data_path = None
-    data = None
     keys = {}
+    data_path = None
+    results = []
+    batch_start = time.time()
+
+    alert_spool = args.alert_spool or os.path.join(args.data_path, "alerts")
+    configure_alerts(alert_spool)
 
     try:
-        api_path = f"{args.data_path}/keys.json"
-        with open(api_path, "r", encoding="utf-8") as f:
-            keys = json.load(f)
-
-        for k in ["OPENAI_API_KEY", "REPLICATE_API_TOKEN", "SUNO_API_KEY"]:
-            if k not in keys:
-                raise RuntimeError(f"{k} is missing in keys.json")
-
-        os.environ["OPENAI_API_KEY"] = keys["OPENAI_API_KEY"]
-        os.environ["REPLICATE_API_TOKEN"] = keys["REPLICATE_API_TOKEN"]
-        os.environ["SUNO_API_KEY"] = keys["SUNO_API_KEY"]
-
-        openai_client = OpenAI()
-
-        # Prompt check + generation
-        data_path = f"{args.data_path}/{args.concept}.json"
-        if not os.path.exists(data_path):
-            with open(data_path, "w", encoding="utf-8") as f:
-                json.dump({}, f, indent=4, ensure_ascii=False)
-            data = {}
+        keys = load_keys(args.data_path)
+        smtp = smtp_config(keys, host=args.smtp_host, port=args.smtp_port)
+        if smtp is not None:
+            configure_alerts(alert_spool, smtp, window=args.alert_window)
         else:
-            with open(data_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-
-        unused_pairs = find_unused_pair(data)
-
-        if not unused_pairs:
-            create_data(openai_client, data)
-            with open(data_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=4, ensure_ascii=False)
-            unused_pairs = find_unused_pair(data)
-
-        # pick job/animals
-        if args.category is not None:
-            job = args.category.replace("_", " ")
-            animals = None
-            for _job, _animals in unused_pairs:
-                if job == _job:
-                    animals = _animals
-                    break
-            if animals is None:
-                raise RuntimeError(f"'{job}' does not exist in unused pair.")
-        else:
-            job, animals = random.choice(unused_pairs)
-
-        job_s = sanitize_file_name(job)
-        output_path = os.path.join(args.output_path, job_s)
-        os.makedirs(output_path, exist_ok=True)
-
-        # generate images/videos
-        video_paths = []
-        for animal in animals:
-            animal_s = sanitize_file_name(animal)
-            image_path = os.path.join(output_path, f"{job_s}_{animal_s}.jpg")
-            if not os.path.exists(image_path):
-                generate_image(job, animal, image_path)
-
-            video_path = os.path.join(output_path, f"{job_s}_{animal_s}.mp4")
-            if not os.path.exists(video_path):
-                generate_video(job, animal, image_path, video_path)
-            video_paths.append(video_path)
-
-        intro_clip = make_intro(video_paths[0], job, intro_sec=1.0)
-
-        animal_clips = []
-        for idx, (animal, vp) in enumerate(zip(animals, video_paths), start=1):
-            c = VideoFileClip(vp)
-            c = overlay_top_caption(c, f"{idx}. {animal.title()}")
-            animal_clips.append(c)
-
-        final = concatenate_videoclips([intro_clip] + animal_clips, method="compose")
-
-        bgm_path = os.path.join(output_path, f"{job_s}_bgm.mp3")
-        if not os.path.exists(bgm_path):
-            generate_bgm(job=job, duration=int(final.duration), audio_path=bgm_path)
-            time.sleep(2.0)
+            print("[WARN] email alert is not configured (ALERT_EMAIL + GMAIL_USER/GMAIL_APP_PASSWORD or SMTP_HOST); "
+                  f"crashes are only spooled to {alert_spool}")
+        if args.tiktok and not keys.get("TIKTOK_ACCESS_TOKEN"):
+            raise RuntimeError("TIKTOK_ACCESS_TOKEN is missing in keys.json")
+        llm = openai_llm(OpenAI())
+
+        with span("dataset_load", store=args.store) as sp:
+            data_path, data = load_data(args.data_path, args.concept, backend=args.store)
+            sp["jobs"] = len(data)
+    except Exception as e:
+        report_crash(e, {"job": None, "data_path": data_path})
+        raise
 
-        audio = AudioFileClip(bgm_path)
-        audio = loop_or_trim_audio_to_duration(audio, final.duration + 0.2).subclipped(0, final.duration)
-        final = final.with_audio(audio)
-
-        final_path = os.path.join(output_path, f"{job_s}_final.mp4")
-        final.write_videofile(
-            final_path,
-            codec="libx264",
-            audio_codec="aac",
-            fps=24,
-            audio=True,
-            preset="medium",
-            threads=4,
+    if args.all_unused:
+        limit = len(find_unused_pair(data)) or 1
+
+    cache = None
+    if not args.no_cache:
+        cache = AssetCache(args.cache_path, max_bytes=int(args.cache_max_gb * 1024 ** 3))
+
+    suno_callback = None
+    if args.suno_callback_url:
+        suno_callback = SunoCallbackServer(
+            args.suno_callback_url,
+            host=args.suno_callback_host,
+            port=args.suno_callback_port,
+            secret=args.suno_callback_secret or keys.get("SUNO_CALLBACK_SECRET"),
+        ).start()
+
+    limits = None
+    if not args.no_limits:
+        overrides = None
+        if args.provider_limits:
+            with open(args.provider_limits, "r", encoding="utf-8") as f:
+                overrides = json.load(f)
+        limits = configure_limits(args.limits_db, overrides)
+
+    lookahead = max(0, args.lookahead)
+    scheduler = StageScheduler(max_workers=args.max_workers + 1)
+    # prefetched jobs run on their own workers so they never queue ahead of the
+    # current job, and on background provider priority until they become current
+    prefetcher = None
+    claimer = None
+    if lookahead:
+        prefetcher = StageScheduler(max_workers=(args.max_workers + 1) * lookahead)
+        # picking a job can block on the replenisher/model; keep that off the render path
+        claimer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="claim")
+
+    # opt-in (--low_watermark N): tops the dataset up in the background,
+    # spending on the model even when no job needs it yet
+    replenisher = None
+    if args.low_watermark > 0 and args.category is None:
+        replenisher = Replenisher(data, llm, low_watermark=args.low_watermark).start()
+
+    attempted = set()
+
+    encode = {
+        "fps": args.fps,
+        "preset": args.preset,
+        "threads": args.threads,
+        "crf": args.crf,
+    }
+    if args.renderer == "stream":
+        encode.update(workers=args.stream_workers, pool_frames=args.stream_frames)
+    elif args.renderer == "segments":
+        encode.update(workers=args.segment_workers)
+
+    def claim_next(background=False):
+        """
+        Pick the next job and queue its provider stages right away. Background
+        claims (--lookahead) run on the claimer thread while earlier jobs are
+        still rendering/uploading, and their stages stay low priority until
+        the job is promoted.
+        """
+        job, animals = pick_job(
+            llm,
+            data,
+            category=args.category,
+            exclude=attempted,
+            output_root=args.output_path,
+            replenisher=replenisher,
+            max_failures=args.max_resume_failures,
         )
+        attempted.add(job)
 
-        # close resources
-        audio.close()
-        final.close()
-        for c in animal_clips:
-            c.close()
-
-        # upload
-        title = f"What it ____ was a {job}"
-        description = f"AI-generated animal {job}"
-
-        video_id = upload_to_youtube(
-            file_path=final_path,
-            title=title,
-            description=description,
-            tags=["ai", "animals", "shorts", job],
-            privacy_status="private",
+        output_path = os.path.join(args.output_path, sanitize_file_name(job))
+        os.makedirs(output_path, exist_ok=True)
+        manifest = JobManifest(output_path, job, animals)
+        foreground = threading.Event()
+        if not background:
+            foreground.set()
+        assets = submit_assets(
+            prefetcher if background else scheduler, job, animals, output_path,
+            cache=cache, suno_callback=suno_callback, manifest=manifest, foreground=foreground,
         )
-        print(f"[Youtube] Uploaded: {video_id}")
-
-        if job in data:
-            data[job]["used"] = True
-            with open(data_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=4, ensure_ascii=False)
-            print(f"[DATA] marked '{job}' as used")
-        else:
-            print(f"[WARN] job '{job}' not found in data")
-
-    except Exception as e:
-        alert_to = keys.get("ALERT_EMAIL")
-        gmail_user = keys.get("GMAIL_USER")
-        gmail_pass = keys.get("GMAIL_APP_PASSWORD")
-
-        if alert_to and gmail_user and gmail_pass:
-            try:
-                notify_crash(
-                    exc=e,
-                    context={
-                        "job": job,
-                        "output_path": output_path,
-                        "final_path": final_path,
-                        "data_path": data_path,
-                    },
-                    to_email=alert_to,
-                    from_email=gmail_user,
-                    app_password=gmail_pass,
-                )
-            except Exception as mail_err:
-                print(f"[WARN] failed to send crash email: {mail_err}")
-        else:
-            print("[WARN] email alert is not configured (ALERT_EMAIL/GMAIL_USER/GMAIL_APP_PASSWORD)")
-
-        raise
+        if background:
+            print(f"[Pipeline] prefetching '{job}'")
+        return {
+            "job": job,
+            "animals": animals,
+            "output_path": output_path,
+            "manifest": manifest,
+            "assets": assets,
+            "foreground": foreground,
+            "claimed": time.time(),
+        }
+
+    # claims (futures) of jobs whose assets are already generating, oldest first
+    pending = deque()
+    exhausted = False
+
+    while len(results) < limit:
+        job = None
+        output_path = None
+        final_path = None
+        manifest = None
+        job_start = time.time()
+
+        try:
+            if pending:
+                try:
+                    # waits only if the background claim has not finished yet
+                    current = pending.popleft().result()
+                except Exception as e:
+                    # nothing more to claim; finish what is already prefetched
+                    print(f"[Pipeline] stopped prefetching: {e!r}")
+                    exhausted = True
+                    continue
+            elif exhausted:
+                break
+            else:
+                current = claim_next()
+            job, animals = current["job"], current["animals"]
+            output_path, manifest = current["output_path"], current["manifest"]
+            job_start = current["claimed"]
+            # now the job being rendered: its remaining stages get the reserved slots
+            current["foreground"].set()
+
+            if any(f.done() and f.exception() is not None for f in pending):
+                exhausted = True
+            while (
+                claimer is not None and not exhausted and len(pending) < lookahead
+                and len(results) + 1 + len(pending) < limit
+            ):
+                pending.append(claimer.submit(claim_next, True))
+
+            final_path = render_short(
+                job,
+                animals,
+                output_path,
+                max_workers=args.max_workers,
+                scheduler=scheduler,
+                cache=cache,
+                suno_callback=suno_callback,
+                renderer=args.renderer,
+                encode=encode,
+                manifest=manifest,
+                assets=current["assets"],
+                preview=args.preview,
+                memory_budget_mb=args.memory_budget_mb,
+                memory_profile=memory_profile,
+            )
+
+            if args.preview:
+                # drafts are for QA only: no upload, job stays unused
+                results.append({"job": job, "ok": True, "seconds": time.time() - job_start})
+                continue
+
+            # upload
+            publish_short(
+                job,
+                final_path,
+                manifest,
+                upload_chunk_mb=args.upload_chunk_mb,
+                tiktok_token=keys.get("TIKTOK_ACCESS_TOKEN") if args.tiktok else None,
+                tiktok_api_base=args.tiktok_api_base,
+            )
+
+            if data.mark_used(job):
+                print(f"[DATA] marked '{job}' as used")
+            else:
+                print(f"[WARN] job '{job}' not found in data")
+            manifest.finish()
+
+            results.append({"job": job, "ok": True, "seconds": time.time() - job_start})
+
+        except Exception as e:
+            if manifest is not None:
+                manifest.record_failure(repr(e))
+            report_crash(
+                e,
+                {
+                    "job": job,
+                    "output_path": output_path,
+                    "final_path": final_path,
+                    "data_path": data_path,
+                },
+            )
+            if single:
+                raise
+            if job is None:
+                print(f"[Batch] stopping, no job could be picked: {e!r}")
+                break
+
+            print(f"[Batch] job '{job}' failed: {e!r}")
+            results.append({"job": job, "ok": False, "seconds": time.time() - job_start})
+
+    if claimer is not None:
+        claimer.shutdown(wait=True)
+        prefetcher.shutdown()
+    scheduler.shutdown()
+    if suno_callback is not None:
+        suno_callback.close()
+    if replenisher is not None:
+        replenisher.close()
+    data.close()
+    shutdown_alerts()
+
+    if limits is not None:
+        print_metrics(limits.metrics())
+
+    print(f"[Trace] run {tracer.run_id}: spans in {tracer.jsonl_path}, metrics in {tracer.prom_path}")
+    print(f"[Memory] peak process-tree RSS {monitor.peak_tree_rss / MB:.0f} MB")
+    monitor.close()
+
+    if cache is not None:
+        stats = cache.stats()
+        print(f"[Cache] hits={stats['hits']} misses={stats['misses']} "
+              f"hit_rate={stats['hit_rate']:.0%} evictions={stats['evictions']} "
+              f"size={stats['bytes'] / 1024 ** 2:.1f}MB")
+        cache.close()
+
+    if not single:
+        print_summary(results, time.time() - batch_start)
+        if any(not r["ok"] for r in results):
+            sys.exit(1)
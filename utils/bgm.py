@@ -1,8 +1,15 @@
 import os
+import json
+import wave
 import requests
+import subprocess
 import time
-from moviepy import AudioFileClip
-from moviepy.audio.AudioClip import concatenate_audioclips
+import numpy as np
+
+from utils.cache import asset_key, file_sha256, recorded_key, forget_key
+from utils.download import download_to, is_valid
+from utils.scheduler import provider_slot
+from utils.trace import span
 
 BGM_PROMPT = """Fast-paced, short intro.
 Anthropomorphic animals as a {job}.
@@ -12,89 +19,246 @@ Modern EDM-inspired cinematic groove.
 No piano, no vocals, no lyrics.
 Target duration: about {duration} seconds (okay if longer; will be trimmed)."""
 
-SUNO_GENERATE_URL = "https://api.sunoapi.org/api/v1/generate"
-SUNO_RECORD_INFO_URL = "https://api.sunoapi.org/api/v1/generate/record-info"
+SUNO_API_BASE = "https://api.sunoapi.org"
+SUNO_GENERATE_PATH = "/api/v1/generate"
+SUNO_RECORD_INFO_PATH = "/api/v1/generate/record-info"
+SUNO_DEFAULT_CALLBACK_URL = "https://api.example.com/callback"
+
+BGM_MODEL = "V4_5ALL"
+
+BGM_PARAMS = {
+    "customMode": True,
+    "instrumental": True,
+    "style": "hybrid electronic cinematic short",
+    "personaId": "",
+    "negativeTags": "vocals, piano, lyrics, singing, heavy metal",
+    "vocalGender": "",
+    "styleWeight": 0.65,
+    "weirdnessConstraint": 0.5,
+    "audioWeight": 0.65,
+}
+
+def _poll_record_info(api_base: str, task_id: str, headers: dict):
+    info_resp = requests.get(
+        api_base + SUNO_RECORD_INFO_PATH,
+        params={"taskId": task_id},
+        headers=headers,
+    )
+    info_resp.raise_for_status()
+    info = info_resp.json()["data"]
+
+    if info["status"] == "SUCCESS":
+        suno_data = info["response"]["sunoData"]
+        return suno_data[0]["audioUrl"]
+    return None
+
+def bgm_key(job: str, duration: int) -> str:
+    return asset_key(BGM_MODEL, BGM_PROMPT.format(job=job, duration=duration), BGM_PARAMS)
+
+def validate_audio(path: str):
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "a:0",
+        "-show_entries", "stream=codec_name:format=duration",
+        "-of", "json",
+        path,
+    ]
+    info = json.loads(subprocess.run(cmd, check=True, capture_output=True, text=True).stdout)
+    if not info.get("streams"):
+        raise ValueError("no audio stream")
+    if float(info.get("format", {}).get("duration") or 0) <= 0:
+        raise ValueError("zero-length audio")
 
 def generate_bgm(
     job: str,
     duration: int,
-    audio_path: str
+    audio_path: str,
+    cache=None,
+    callback=None,
+    api_base: str = SUNO_API_BASE,
+    poll_initial: float = 2.0,
+    poll_max: float = 15.0,
+    timeout: float = 600.0,
 ):
-    prompt = BGM_PROMPT.format(job=job, duration=duration)
-    suno_api_key = os.environ.get("SUNO_API_KEY")
-
-    payload = {
-        "customMode": True,
-        "instrumental": True,
-        "model": "V4_5ALL",
-        "callBackUrl": "https://api.example.com/callback",
-        "prompt": prompt,
-        "style": "hybrid electronic cinematic short",
-        "title": f"{job} bgm",
-        "personaId": "",
-        "negativeTags": "vocals, piano, lyrics, singing, heavy metal",
-        "vocalGender": "",
-        "styleWeight": 0.65,
-        "weirdnessConstraint": 0.5,
-        "audioWeight": 0.65,
-    }
-
-    headers = {
-        "Authorization": f"Bearer {suno_api_key}",
-        "Content-Type": "application/json",
-    }
-
-    resp = requests.post(SUNO_GENERATE_URL, json=payload, headers=headers)
-    resp.raise_for_status()
-    task_id = resp.json()["data"]["taskId"]
-
-    print(f"[Suno] taskId = {task_id}")
-
-    audio_url = None
-    for _ in range(120):
-        time.sleep(5)
-
-        info_resp = requests.get(
-            SUNO_RECORD_INFO_URL,
-            params={"taskId": task_id},
-            headers=headers,
-        )
-        info_resp.raise_for_status()
-        info = info_resp.json()["data"]
-
-        if info["status"] == "SUCCESS":
-            suno_data = info["response"]["sunoData"]
-            audio_url = suno_data[0]["audioUrl"]
-            break
-
-    if audio_url is None:
-        raise RuntimeError("Suno BGM generation timed out")
-
-    print("[Suno] downloading:", audio_url)
-    r = requests.get(audio_url, stream=True)
-    r.raise_for_status()
-    with open(audio_path, "wb") as f:
-        for chunk in r.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
-
-    print("[Suno] BGM saved to:", audio_path)
-
-def loop_or_trim_audio_to_duration(audio_clip: AudioFileClip, target_duration: float):
-    if audio_clip.duration is None:
-        return audio_clip
-
-    if audio_clip.duration >= target_duration:
-        return audio_clip.subclipped(0, target_duration)
-
-    parts = []
-    t = 0.0
-    while t < target_duration:
-        remain = target_duration - t
-        if audio_clip.duration <= remain:
-            parts.append(audio_clip)
-            t += audio_clip.duration
-        else:
-            parts.append(audio_clip.subclipped(0, remain))
-            t += remain
-    return concatenate_audioclips(parts)
\ No newline at end of file
+    """
+    `callback` is an optional started SunoCallbackServer; when given, the
+    result is picked up the moment Suno posts it and record-info polling
+    (with exponential backoff) only serves as a fallback.
+    Returns True if Suno was actually called, False if the cache (or an
+    existing file made from the same prompt) supplied the track.
+    """
+    with span("generate_bgm", job=job, duration=duration, callback=callback is not None) as sp:
+        prompt = BGM_PROMPT.format(job=job, duration=duration)
+        suno_api_key = os.environ.get("SUNO_API_KEY")
+
+        key = None
+        if cache is not None:
+            key = bgm_key(job, duration)
+            if cache.fetch(key, audio_path):
+                print(f"[Cache] BGM hit for {job}")
+                sp["cache_hit"] = True
+                return False
+            if recorded_key(audio_path) == key and is_valid(audio_path, validate_audio):
+                print(f"[Cache] adopting existing BGM for {job}")
+                cache.store(key, audio_path)
+                sp["adopted"] = True
+                return False
+
+        payload = {
+            **BGM_PARAMS,
+            "model": BGM_MODEL,
+            "callBackUrl": callback.callback_url if callback is not None else SUNO_DEFAULT_CALLBACK_URL,
+            "prompt": prompt,
+            "title": f"{job} bgm",
+        }
+
+        headers = {
+            "Authorization": f"Bearer {suno_api_key}",
+            "Content-Type": "application/json",
+        }
+
+        # one Suno slot covers the generation task until its result is known
+        with provider_slot("suno"):
+            resp = requests.post(api_base + SUNO_GENERATE_PATH, json=payload, headers=headers)
+            resp.raise_for_status()
+            task_id = resp.json()["data"]["taskId"]
+
+            print(f"[Suno] taskId = {task_id}")
+
+            audio_url = None
+            interval = poll_initial
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                wait = min(interval, max(0.0, deadline - time.time()))
+                if callback is not None:
+                    audio_url = callback.wait(task_id, timeout=wait)
+                    if audio_url is not None:
+                        print("[Suno] result received via callback")
+                        break
+                else:
+                    time.sleep(wait)
+
+                audio_url = _poll_record_info(api_base, task_id, headers)
+                if audio_url is not None:
+                    break
+                interval = min(interval * 1.5, poll_max)
+
+        if audio_url is None:
+            raise RuntimeError("Suno BGM generation timed out")
+
+        print("[Suno] downloading:", audio_url)
+        forget_key(audio_path)
+        sp["bytes"] = download_to(audio_url, audio_path, validate=validate_audio, tag="[Suno]")
+        print("[Suno] BGM saved to:", audio_path)
+
+        if cache is not None:
+            cache.store(key, audio_path)
+        return True
+
+BGM_SAMPLE_RATE = 44100
+BGM_CROSSFADE_SEC = 0.05
+BGM_FADE_OUT_SEC = 0.5
+# RMS target and peak ceiling used for loudness normalization
+BGM_TARGET_RMS_DB = -16.0
+BGM_PEAK_DB = -1.0
+
+def decode_audio(path: str, sample_rate: int = BGM_SAMPLE_RATE) -> np.ndarray:
+    """
+    Decode the whole file once to float32 stereo PCM, shape (samples, 2).
+    """
+    cmd = [
+        "ffmpeg", "-v", "error",
+        "-i", path,
+        "-f", "f32le", "-ac", "2", "-ar", str(sample_rate),
+        "-",
+    ]
+    raw = subprocess.run(cmd, check=True, capture_output=True).stdout
+    return np.frombuffer(raw, dtype=np.float32).reshape(-1, 2)
+
+def tile_with_crossfade(pcm: np.ndarray, n_target: int, crossfade: int) -> np.ndarray:
+    """
+    Loop `pcm` to exactly `n_target` samples, overlapping each seam by
+    `crossfade` samples with an equal-gain linear fade.
+    """
+    n = len(pcm)
+    if n == 0:
+        return np.zeros((n_target, pcm.shape[1]), dtype=np.float32)
+    if n >= n_target:
+        return pcm[:n_target].copy()
+
+    crossfade = min(crossfade, n // 2)
+    step = n - crossfade
+    copies = int(np.ceil((n_target - crossfade) / step))
+
+    out = np.zeros((copies * step + crossfade, pcm.shape[1]), dtype=np.float32)
+    fade_in = np.linspace(0.0, 1.0, crossfade, dtype=np.float32)[:, None]
+    head = pcm.copy()
+    head[:crossfade] *= fade_in
+    tail_gain = np.ones((n, 1), dtype=np.float32)
+    tail_gain[n - crossfade:] = 1.0 - fade_in
+
+    for i in range(copies):
+        seg = head if i > 0 else pcm
+        if i < copies - 1:
+            seg = seg * tail_gain
+        out[i * step:i * step + n] += seg
+    return out[:n_target]
+
+def normalize_loudness(pcm: np.ndarray, target_rms_db: float = BGM_TARGET_RMS_DB, peak_db: float = BGM_PEAK_DB) -> np.ndarray:
+    rms = float(np.sqrt(np.mean(np.square(pcm, dtype=np.float64))))
+    if rms <= 1e-9:
+        return pcm
+    gain = 10 ** (target_rms_db / 20) / rms
+    peak = float(np.max(np.abs(pcm))) * gain
+    ceiling = 10 ** (peak_db / 20)
+    if peak > ceiling:
+        gain *= ceiling / peak
+    return pcm * np.float32(gain)
+
+def write_wav(path: str, pcm: np.ndarray, sample_rate: int = BGM_SAMPLE_RATE):
+    pcm16 = (np.clip(pcm, -1.0, 1.0) * 32767.0).astype("<i2")
+    tmp = path + ".tmp"
+    with wave.open(tmp, "wb") as w:
+        w.setnchannels(pcm.shape[1])
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(pcm16.tobytes())
+    os.replace(tmp, path)
+
+def fit_bgm(
+    bgm_path: str,
+    duration: float,
+    out_dir: str,
+    crossfade: float = BGM_CROSSFADE_SEC,
+    fade_out: float = BGM_FADE_OUT_SEC,
+    sample_rate: int = BGM_SAMPLE_RATE,
+) -> str:
+    """
+    Decode the BGM once, loop (with seam crossfades) or trim it to exactly
+    `duration`, fade out and normalize loudness, and write one flat WAV.
+    The result is cached per (bgm hash, duration).
+    """
+    key = file_sha256(bgm_path)[:16]
+    fitted_path = os.path.join(out_dir, f"bgm_fit_{key}_{int(round(duration * 1000))}ms.wav")
+    if os.path.exists(fitted_path):
+        return fitted_path
+
+    with span("fit_bgm", duration=duration) as sp:
+        pcm = decode_audio(bgm_path, sample_rate)
+        n_target = int(round(duration * sample_rate))
+
+        out = tile_with_crossfade(pcm, n_target, int(crossfade * sample_rate))
+        if len(out) < n_target:
+            out = np.pad(out, ((0, n_target - len(out)), (0, 0)))
+
+        n_fade = min(len(out), int(fade_out * sample_rate))
+        if n_fade > 0:
+            out[-n_fade:] *= np.linspace(1.0, 0.0, n_fade, dtype=np.float32)[:, None]
+
+        out = normalize_loudness(out)
+
+        os.makedirs(out_dir, exist_ok=True)
+        write_wav(fitted_path, out, sample_rate)
+        sp["bytes"] = os.path.getsize(fitted_path)
+
+    return fitted_path
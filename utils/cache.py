@@ -0,0 +1,200 @@
+import os
+import json
+import shutil
+import sqlite3
+import hashlib
+import threading
+import time
+
+KEY_SUFFIX = ".key"
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def asset_key(model: str, prompt: str, params: dict, input_path: str = None) -> str:
+    """
+    Content address of a generated asset: model + formatted prompt + params
+    (+ hash of the input file, e.g. the source image for image-to-video).
+    """
+    payload = {
+        "model": model,
+        "prompt": prompt,
+        "params": params,
+        "input": file_sha256(input_path) if input_path else None,
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def recorded_key(path: str):
+    """
+    The asset key stored next to `path` (`<path>.key`) when the cache last
+    wrote or read it, or None for files of unknown origin.
+    """
+    try:
+        with open(path + KEY_SUFFIX, "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def record_key(path: str, key: str):
+    tmp = path + KEY_SUFFIX + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(key)
+    os.replace(tmp, path + KEY_SUFFIX)
+
+def forget_key(path: str):
+    # called before `path` is overwritten, so a crash never leaves a stale key behind
+    try:
+        os.remove(path + KEY_SUFFIX)
+    except FileNotFoundError:
+        pass
+
+
+class AssetCache:
+    """
+    Size-bounded, content-addressed store for generated images/videos/BGM.
+    Entries live under `root/objects/` and are tracked in `root/index.db`
+    (SQLite, WAL) in least-recently-used order, so concurrent runs share one
+    index: a hit updates a single row and eviction runs in one transaction.
+    """
+
+    def __init__(self, root: str, max_bytes: int = 10 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(root, "index.db")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._conn = sqlite3.connect(
+            self.index_path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, file TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)")
+        self._import_json_index()
+
+    def _import_json_index(self):
+        # one-time migration of the index.json used by earlier versions
+        legacy = os.path.join(self.root, "index.json")
+        try:
+            with open(legacy, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            for key, entry in entries.items():
+                if os.path.exists(self._object_path(entry["file"])):
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO entries (key, file, size, last_access) VALUES (?, ?, ?, ?)",
+                        (key, entry["file"], entry["size"], entry["last_access"]),
+                    )
+            self._conn.execute("COMMIT")
+        try:
+            os.replace(legacy, legacy + ".imported")
+        except FileNotFoundError:
+            pass  # another run migrated it at the same time
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _object_path(self, name: str) -> str:
+        return os.path.join(self.root, "objects", name)
+
+    def _evict(self, keep: str):
+        # called inside the store transaction; never evicts the entry just stored
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT key, file, size FROM entries WHERE key != ? ORDER BY last_access", (keep,)
+        ).fetchall()
+        for key, name, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            try:
+                os.remove(self._object_path(name))
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def fetch(self, key: str, dest_path: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT file FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or not os.path.exists(self._object_path(row[0])):
+                if row is not None:
+                    self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.misses += 1
+                return False
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            src = self._object_path(row[0])
+
+        if os.path.abspath(src) != os.path.abspath(dest_path):
+            tmp = dest_path + ".part"
+            try:
+                shutil.copyfile(src, tmp)
+            except FileNotFoundError:
+                # evicted by another run between the lookup and the copy
+                with self._lock:
+                    self.misses += 1
+                return False
+            forget_key(dest_path)
+            os.replace(tmp, dest_path)
+        record_key(dest_path, key)
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, key: str, src_path: str):
+        ext = os.path.splitext(src_path)[1]
+        name = f"{key}{ext}"
+        tmp = self._object_path(name + ".tmp")
+        shutil.copyfile(src_path, tmp)
+        os.replace(tmp, self._object_path(name))
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, file, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, name, os.path.getsize(self._object_path(name)), time.time()),
+                )
+                self._evict(keep=key)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        record_key(src_path, key)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
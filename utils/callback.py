@@ -0,0 +1,116 @@
+import hmac
+import json
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SUNO_CALLBACK_PATH = "/suno/callback"
+
+
+class SunoCallbackServer:
+    """
+    Tiny embedded HTTP receiver for Suno's `callBackUrl` posts.
+    `public_url` is what Suno can reach (e.g. behind a tunnel/reverse proxy);
+    the server itself listens on `host:port`, loopback by default. Only posts
+    to `SUNO_CALLBACK_PATH/<secret>` are accepted, so nobody who merely
+    reaches the port can inject an audio URL; the secret is random per run
+    unless given.
+    """
+
+    def __init__(self, public_url: str, host: str = "127.0.0.1", port: int = 8765, secret: str = None):
+        self._secret = secret or secrets.token_urlsafe(24)
+        self.callback_url = f"{public_url.rstrip('/')}{SUNO_CALLBACK_PATH}/{self._secret}"
+        self._results = {}
+        self._events = {}
+        self._lock = threading.Lock()
+
+        receiver = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                path = self.path.split("?")[0]
+                if not path.startswith(SUNO_CALLBACK_PATH + "/"):
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                token = path[len(SUNO_CALLBACK_PATH) + 1:]
+                if not hmac.compare_digest(token.encode("utf-8"), receiver._secret.encode("utf-8")):
+                    self.send_response(403)
+                    self.end_headers()
+                    return
+
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                except json.JSONDecodeError:
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+
+                receiver._handle(payload)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(b'{"status":"received"}')
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self.host = host
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        print(f"[Suno] callback receiver listening on {self.host}:{self.port}")
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _event(self, task_id: str) -> threading.Event:
+        with self._lock:
+            if task_id not in self._events:
+                self._events[task_id] = threading.Event()
+            return self._events[task_id]
+
+    def _handle(self, payload: dict):
+        data = payload.get("data") or {}
+        task_id = data.get("task_id") or data.get("taskId")
+        if not task_id:
+            return
+
+        callback_type = data.get("callbackType")
+        if payload.get("code", 200) != 200 or callback_type == "error":
+            result = {"error": payload.get("msg") or "Suno reported an error"}
+        elif callback_type == "complete":
+            tracks = data.get("data") or []
+            url = (tracks[0].get("audio_url") or tracks[0].get("audioUrl")) if tracks else None
+            if not url:
+                return
+            result = {"audio_url": url}
+        else:
+            # "text"/"first" callbacks are progress notifications
+            return
+
+        with self._lock:
+            self._results[task_id] = result
+        self._event(task_id).set()
+
+    def wait(self, task_id: str, timeout: float):
+        """
+        Block up to `timeout` seconds for the task's callback.
+        Returns the audio URL, or None if nothing has arrived yet.
+        """
+        if not self._event(task_id).wait(timeout):
+            return None
+
+        with self._lock:
+            result = self._results.pop(task_id)
+            self._events.pop(task_id, None)
+
+        if "error" in result:
+            raise RuntimeError(f"Suno BGM generation failed: {result['error']}")
+        return result["audio_url"]
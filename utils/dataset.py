@@ -0,0 +1,308 @@
+import re
+import json
+import time
+import random
+import difflib
+import argparse
+import threading
+
+from utils.utils import find_unused_pair
+from utils.scheduler import provider_slot
+from utils.trace import span
+
+DATA_PROMPT = """You are helping me build a dataset for generative video creation.
+
+Task:
+- Generate EXACTLY {count} unique jobs.
+- For each job, list 3–4 animals that would be visually and conceptually suitable for that job.
+- Jobs must be imaginative but still easy to recognize visually in a short video.
+- Animals should make intuitive sense for the job (based on behavior, stereotypes, or symbolism).
+
+Constraints:
+- Prefer less common jobs. These already exist (a sample), so DO NOT reuse or paraphrase them:
+{existing_jobs}
+
+- Each job must be a single noun phrase (e.g., "firefighter", "librarian", "street photographer").
+- Animals must be common, recognizable animals (no mythical creatures).
+
+Output format:
+Return ONLY valid JSON in the following structure:
+
+{{
+  "job_name": {{
+    "animals": ["animal_1", "animal_2", ...],
+    "used": false
+  }}
+}}
+
+- Use lowercase for all job and animal names.
+- Do not include any explanations, comments, or extra text.
+"""
+
+DATA_MODEL = "gpt-5-nano"
+DATA_BATCH = 10
+# existing jobs shown to the model as examples to avoid; the index does the real filtering
+AVOID_SAMPLE = 20
+# difflib ratio above which two joined-up job names count as the same job;
+# only applied to long names, where one or two letters are a typo rather
+# than a different job ("driver" vs "diver", "banker" vs "baker")
+FUZZY_CUTOFF = 0.9
+FUZZY_MIN_LEN = 10
+
+_STOPWORDS = {"a", "an", "the", "of", "for", "and"}
+
+
+def _singular(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("ches", "shes", "sses", "xes", "zes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+def _job_words(name: str) -> list:
+    words = re.findall(r"[a-z0-9]+", name.lower())
+    return [_singular(w) for w in words if w not in _STOPWORDS]
+
+def normalize_job(name: str) -> str:
+    """
+    Canonical form used for duplicate checks: lowercase, punctuation and
+    articles dropped, every word singularized, words sorted.
+    "The Street-Photographers" -> "photographer street".
+    """
+    return " ".join(sorted(_job_words(name)))
+
+def _compact_job(name: str) -> str:
+    # word order kept so "fire fighters" and "firefighter" collapse together
+    return "".join(_job_words(name))
+
+
+class DedupeIndex:
+    """
+    Normalized names of every known job. A candidate is a duplicate if its
+    normalized form, or the form with spaces removed ("fire fighter" vs
+    "firefighter"), matches a known job exactly; names of FUZZY_MIN_LEN+
+    letters also match on a near-identical spelling.
+    """
+
+    def __init__(self, names=()):
+        self._lock = threading.Lock()
+        self._by_key = {}
+        self._compact = {}
+        self.names = []
+        for name in names:
+            self.add(name)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add(self, name: str):
+        key = normalize_job(name)
+        with self._lock:
+            if key in self._by_key:
+                return
+            self._by_key[key] = name
+            self._compact[_compact_job(name)] = name
+            self.names.append(name)
+
+    def match(self, name: str):
+        """
+        The existing job `name` duplicates, or None.
+        """
+        key = normalize_job(name)
+        compact = _compact_job(name)
+        with self._lock:
+            if key in self._by_key:
+                return self._by_key[key]
+            if compact in self._compact:
+                return self._compact[compact]
+            if len(compact) < FUZZY_MIN_LEN:
+                return None
+            candidates = [c for c in self._compact if len(c) >= FUZZY_MIN_LEN]
+            close = difflib.get_close_matches(compact, candidates, n=1, cutoff=FUZZY_CUTOFF)
+        return self._compact[close[0]] if close else None
+
+    def sample(self, k: int) -> list:
+        with self._lock:
+            return random.sample(self.names, min(k, len(self.names)))
+
+
+def openai_llm(client, model: str = DATA_MODEL):
+    """
+    Wrap an OpenAI client as the `llm(prompt) -> text` callable create_data uses.
+    """
+    def _call(prompt: str) -> str:
+        response = client.responses.create(model=model, input=prompt)
+        return response.output_text
+    return _call
+
+def create_data(llm, data, index: DedupeIndex = None, count: int = DATA_BATCH, stop: threading.Event = None):
+    """
+    Ask `llm` for `count` new jobs and add the ones that are not duplicates
+    of anything in `index` (built from `data` if not given). If `stop` is
+    set by the time the model answers, the batch is dropped unwritten.
+    Returns (added, rejected).
+    """
+    if index is None:
+        index = DedupeIndex(data.keys())
+
+    avoid = index.sample(AVOID_SAMPLE)
+    prompt = DATA_PROMPT.format(
+        count=count,
+        existing_jobs=", ".join(avoid) if avoid else "none",
+    )
+
+    with span("create_data", existing=len(index), avoid=len(avoid)) as sp:
+        with provider_slot("openai"):
+            raw_text = llm(prompt)
+        if stop is not None and stop.is_set():
+            sp["dropped"] = True
+            return 0, 0
+
+        try:
+            raw = raw_text.strip()
+            raw = raw[raw.find("{"): raw.rfind("}") + 1]
+            new_data = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise RuntimeError(
+                f"Failed to parse JSON from model output:\n{raw_text}"
+            ) from e
+
+        accepted = {}
+        rejected = 0
+        for job, value in new_data.items():
+            job = " ".join(job.lower().split())
+            if not job or not isinstance(value, dict) or not value.get("animals"):
+                rejected += 1
+                continue
+            dup = index.match(job)
+            if dup is not None:
+                print(f"[DATA] rejecting '{job}' (duplicate of '{dup}')")
+                rejected += 1
+                continue
+            index.add(job)
+            accepted[job] = {"animals": list(value["animals"]), "used": False}
+
+        if accepted:
+            data.update(accepted)
+        sp["added"] = len(accepted)
+        sp["rejected"] = rejected
+        print(f"[DATA] added {len(accepted)} jobs, rejected {rejected}")
+    return len(accepted), rejected
+
+
+class Replenisher:
+    """
+    Background thread that keeps at least `low_watermark` unused jobs in the
+    dataset, so picking a job never waits on the model unless it outruns
+    the refill.
+    """
+
+    def __init__(self, data, llm, low_watermark: int = 3, interval: float = 30.0, index: DedupeIndex = None):
+        self.data = data
+        self.llm = llm
+        self.low_watermark = low_watermark
+        self.interval = interval
+        self.index = index or DedupeIndex(data.keys())
+        self.added = 0
+        self.rejected = 0
+        self.last_error = None
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._refilled = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="replenisher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def kick(self):
+        self._wake.set()
+
+    def _unused(self) -> int:
+        return len(find_unused_pair(self.data))
+
+    def _run(self):
+        delay = self.interval
+        while not self._stop.is_set():
+            try:
+                while not self._stop.is_set() and self._unused() < self.low_watermark:
+                    added, rejected = create_data(self.llm, self.data, self.index, stop=self._stop)
+                    self.added += added
+                    self.rejected += rejected
+                    if added == 0:
+                        break  # a batch of pure duplicates; don't spin on the model
+                self.last_error = None
+                delay = self.interval
+            except Exception as e:
+                if self._stop.is_set():
+                    break  # shutting down; the store may already be closed
+                self.last_error = e
+                delay = min(delay * 2, 600)
+                print(f"[DATA] replenish failed: {e!r}, retrying in {delay:.0f}s")
+
+            with self._refilled:
+                self._refilled.notify_all()
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def wait_for_unused(self, timeout: float = 300.0) -> bool:
+        """
+        Block until at least one unused job exists (or `timeout` passes).
+        """
+        deadline = time.time() + timeout
+        self.kick()
+        with self._refilled:
+            while self._unused() == 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._refilled.wait(remaining)
+        return True
+
+    def close(self, timeout: float = 2.0):
+        """
+        Stop the worker. A model call still in flight is not waited for: its
+        batch is dropped when it returns, so exit is not held up by it.
+        """
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=timeout)
+
+
+if __name__ == "__main__":
+    from utils.store import open_store
+
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_check = sub.add_parser("check")
+    p_check.add_argument("data_file", type=str)
+    p_check.add_argument("names", type=str, nargs="+")
+
+    p_fill = sub.add_parser("fill")
+    p_fill.add_argument("data_file", type=str)
+    p_fill.add_argument("--low_watermark", type=int, default=3)
+
+    args = parser.parse_args()
+    data = open_store(args.data_file)
+
+    if args.command == "check":
+        index = DedupeIndex(data.keys())
+        for name in args.names:
+            dup = index.match(name)
+            print(f"{name!r}: " + (f"duplicate of {dup!r}" if dup else "new"))
+    else:
+        from openai import OpenAI
+        llm = openai_llm(OpenAI())
+        index = DedupeIndex(data.keys())
+        added = rejected = 0
+        while len(find_unused_pair(data)) < args.low_watermark:
+            a, r = create_data(llm, data, index)
+            added, rejected = added + a, rejected + r
+            if a == 0:
+                break
+        print(f"[DATA] unused: {len(find_unused_pair(data))}, added {added}, rejected {rejected}")
+    data.close()
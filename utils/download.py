@@ -0,0 +1,91 @@
+import os
+import time
+import random
+import requests
+
+DOWNLOAD_CHUNK = 1 << 20  # 1 MiB
+DOWNLOAD_TIMEOUT = (10, 60)  # connect, read
+
+
+class DownloadError(RuntimeError):
+    pass
+
+
+def _source_url(source):
+    # replicate FileOutput exposes .url; Suno hands back a plain URL string
+    if isinstance(source, str):
+        return source
+    return getattr(source, "url", None)
+
+def _stream_chunks(source, chunk_size: int):
+    url = _source_url(source)
+    if url is not None and url.startswith(("http://", "https://")):
+        with requests.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+            r.raise_for_status()
+            expected = r.headers.get("Content-Length")
+            got = 0
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    got += len(chunk)
+                    yield chunk
+            if expected is not None and got != int(expected):
+                raise DownloadError(f"truncated: {got} of {expected} bytes")
+    else:
+        # file-like / iterable outputs (e.g. data: URLs) are consumed as they come
+        yield from source
+
+def download_to(
+    source,
+    dest_path: str,
+    validate=None,
+    max_retries: int = 4,
+    chunk_size: int = DOWNLOAD_CHUNK,
+    tag: str = "[Download]",
+) -> int:
+    """
+    Stream `source` (URL or provider file output) into `dest_path.part`,
+    check it with `validate(path)` (raises on a bad file), then atomically
+    rename it into place. Retries with exponential backoff; a partial or
+    invalid file never appears at `dest_path`. Returns the byte count.
+    """
+    tmp = dest_path + ".part"
+    retryable = _source_url(source) is not None
+
+    for attempt in range(max_retries + 1):
+        try:
+            written = 0
+            with open(tmp, "wb") as f:
+                for chunk in _stream_chunks(source, chunk_size):
+                    f.write(chunk)
+                    written += len(chunk)
+            if written == 0:
+                raise DownloadError("empty response")
+            if validate is not None:
+                validate(tmp)
+            os.replace(tmp, dest_path)
+            return written
+        except Exception as e:
+            error = repr(e)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+        if attempt == max_retries or not retryable:
+            raise DownloadError(f"{tag} {os.path.basename(dest_path)} failed: {error}")
+        delay = min(2 ** attempt, 30) + random.random()
+        print(f"{tag} {os.path.basename(dest_path)}: {error}, retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+def is_valid(path: str, validate) -> bool:
+    """
+    True if `path` exists and passes `validate`; used to vet files left
+    behind by earlier runs before reusing them.
+    """
+    if not os.path.exists(path):
+        return False
+    try:
+        validate(path)
+    except Exception as e:
+        print(f"[Download] discarding invalid {path}: {e!r}")
+        return False
+    return True
@@ -0,0 +1,190 @@
+import os
+import json
+import glob
+import hashlib
+import threading
+import time
+
+from utils.cache import file_sha256
+
+MANIFEST_NAME = "manifest.json"
+# a job that failed this many runs is no longer resumed automatically
+MAX_RESUME_FAILURES = 3
+
+
+def inputs_hash(*parts) -> str:
+    """
+    Hash of a stage's inputs. File paths are hashed by content, everything
+    else by its JSON form.
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str) and os.path.isfile(part):
+            h.update(file_sha256(part).encode("utf-8"))
+        else:
+            h.update(json.dumps(part, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+class JobManifest:
+    """
+    Per-job checkpoint file in the job's output folder. Each stage records its
+    status, an inputs hash and the sha256 of its output file, so a rerun can
+    resume at the first stage whose output is missing, changed or stale.
+    """
+
+    def __init__(self, output_path: str, job: str, animals: list):
+        self.path = os.path.join(output_path, MANIFEST_NAME)
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+            if self._data.get("job") != job or self._data.get("animals") != list(animals):
+                # a different job/animal set reuses the folder; start over
+                self._data = None
+        else:
+            self._data = None
+
+        if self._data is None:
+            self._data = {
+                "job": job,
+                "animals": list(animals),
+                "status": "in_progress",
+                "created": time.time(),
+                "stages": {},
+            }
+            self._save()
+
+    @property
+    def job(self) -> str:
+        return self._data["job"]
+
+    @property
+    def animals(self) -> list:
+        return self._data["animals"]
+
+    @property
+    def status(self) -> str:
+        return self._data["status"]
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, indent=4, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def get(self, stage: str) -> dict:
+        with self._lock:
+            return dict(self._data["stages"].get(stage) or {})
+
+    def output_of(self, stage: str, inputs: str = None):
+        """
+        The recorded output path if `stage` is done, its inputs are unchanged
+        and the output file still matches its checksum; otherwise None.
+        """
+        entry = self.get(stage)
+        if entry.get("status") != "done":
+            return None
+        if inputs is not None and entry.get("inputs") != inputs:
+            return None
+
+        output = entry.get("output")
+        if output is None:
+            return None
+        if not os.path.exists(output) or file_sha256(output) != entry.get("sha256"):
+            return None
+        return output
+
+    def is_done(self, stage: str) -> bool:
+        return self.get(stage).get("status") == "done"
+
+    def start(self, stage: str, inputs: str = None):
+        with self._lock:
+            self._data["status"] = "in_progress"
+            self._data["stages"][stage] = {
+                "status": "in_progress",
+                "inputs": inputs,
+                "started": time.time(),
+            }
+            self._save()
+
+    def complete(self, stage: str, output: str = None, inputs: str = None, **extra):
+        entry = {
+            "status": "done",
+            "inputs": inputs,
+            "output": output,
+            "sha256": file_sha256(output) if output else None,
+            "finished": time.time(),
+        }
+        entry.update(extra)
+        with self._lock:
+            self._data["stages"][stage] = entry
+            self._save()
+
+    def fail(self, stage: str, error: str):
+        with self._lock:
+            entry = self._data["stages"].setdefault(stage, {})
+            entry["status"] = "failed"
+            entry["error"] = error
+            self._save()
+
+    def record_failure(self, error: str):
+        """
+        Count one failed run of the whole job, so `find_in_progress` can stop
+        resuming a job that keeps failing.
+        """
+        with self._lock:
+            self._data["failures"] = self._data.get("failures", 0) + 1
+            self._data["last_error"] = error
+            self._save()
+
+    def finish(self):
+        with self._lock:
+            self._data["status"] = "done"
+            self._data["finished"] = time.time()
+            self._save()
+
+
+def run_stage(manifest, stage: str, fn, *args, inputs: str = None, **kwargs):
+    """
+    Run one output-producing stage through the manifest: skip it if its
+    checkpoint is still valid, otherwise record start/completion around `fn`.
+    """
+    if manifest is None:
+        return fn(*args, **kwargs)
+
+    output = manifest.output_of(stage, inputs)
+    if output is not None:
+        print(f"[Resume] {stage}: reusing {output}")
+        return output
+
+    manifest.start(stage, inputs)
+    try:
+        output = fn(*args, **kwargs)
+    except Exception as e:
+        manifest.fail(stage, repr(e))
+        raise
+    manifest.complete(stage, output, inputs)
+    return output
+
+def find_in_progress(output_root: str, max_failures: int = MAX_RESUME_FAILURES) -> list:
+    """
+    Manifests under `output_root/*/` that never reached `done`, oldest first.
+    Jobs that already failed `max_failures` runs are left alone.
+    """
+    found = []
+    for path in glob.glob(os.path.join(output_root, "*", MANIFEST_NAME)):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        if data.get("status") == "done":
+            continue
+        if data.get("failures", 0) >= max_failures:
+            print(f"[Resume] skipping '{data['job']}' after {data['failures']} failed runs: {data.get('last_error')}")
+            continue
+        found.append((data.get("created", 0), data["job"], data["animals"]))
+    found.sort()
+    return [(job, animals) for _, job, animals in found]
@@ -0,0 +1,291 @@
+import os
+import json
+import time
+import resource
+import threading
+import subprocess
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+MB = 1024 ** 2
+_PAGE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# fixed overhead per renderer (interpreter, decoders, x264 lookahead), in MB;
+# the frame-buffer part is modelled in estimate_render_mb
+RENDER_BASE_MB = {"moviepy": 300, "ffmpeg": 120, "stream": 200, "segments": 100}
+PROFILE_NAME = "memory_profile.json"
+
+
+def _rss_of(pid) -> int:
+    try:
+        with open(f"/proc/{pid}/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def _children(pid) -> list:
+    out = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children", "r") as f:
+                out += [int(c) for c in f.read().split()]
+    except OSError:
+        pass
+    return out
+
+def rss_bytes() -> int:
+    """
+    Current RSS of this process (Linux /proc; elsewhere the lifetime peak
+    from getrusage).
+    """
+    rss = _rss_of("self")
+    if rss:
+        return rss
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def tree_rss_bytes(root: int = None) -> int:
+    """
+    RSS of `root` (default: this process) plus its descendants (ffmpeg,
+    compositing workers).
+    """
+    total, stack = 0, [os.getpid() if root is None else root]
+    while stack:
+        pid = stack.pop()
+        total += _rss_of(pid) if pid != os.getpid() else rss_bytes()
+        stack += _children(pid)
+    return total
+
+
+class TreeRssSampler:
+    """
+    Polls the process-tree RSS of another process (e.g. a benchmark child)
+    on a background thread; `stop()` returns the peak in bytes. Unlike
+    ru_maxrss, which is the peak of a single process, this covers the
+    child and every ffmpeg/worker it spawns.
+    """
+
+    def __init__(self, pid: int, interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="tree-rss-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            self.peak = max(self.peak, tree_rss_bytes(self.pid))
+            if self._stop.wait(self.interval):
+                break
+
+    def stop(self) -> int:
+        self._stop.set()
+        self._thread.join()
+        return self.peak
+
+def run_child(cmd: list) -> dict:
+    """
+    Run `cmd` to completion and measure exactly that process: wall time,
+    CPU time from wait4 (which includes reaped ffmpeg grandchildren) and
+    the sampled peak RSS of its whole process tree.
+    """
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd)
+    sampler = TreeRssSampler(proc.pid).start()
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    peak = sampler.stop()
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        "exit_code": proc.returncode,
+        "wall_s": wall,
+        "cpu_s": usage.ru_utime + usage.ru_stime,
+        "peak_tree_rss_mb": peak / MB,
+    }
+
+
+class MemoryMonitor:
+    """
+    Samples process-tree RSS (and, if enabled, the tracemalloc peak) on a
+    background thread. Each `watch()` block reports the highest values seen
+    while it was open, so overlapping stages each get the peak that
+    happened during them.
+    """
+
+    def __init__(self, interval: float = 0.05, trace_python: bool = False):
+        self.interval = interval
+        self.trace_python = trace_python
+        self.peak_tree_rss = 0
+        self._lock = threading.Lock()
+        self._watches = []
+        self._stop = threading.Event()
+        if trace_python and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._thread = threading.Thread(target=self._run, name="memory-monitor", daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        tree = tree_rss_bytes()
+        py_peak = 0
+        if self.trace_python:
+            py_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.reset_peak()
+        with self._lock:
+            self.peak_tree_rss = max(self.peak_tree_rss, tree)
+            for w in self._watches:
+                w["tree_peak"] = max(w["tree_peak"], tree)
+                w["py_peak"] = max(w["py_peak"], py_peak)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    @contextmanager
+    def watch(self):
+        """
+        `with monitor.watch() as mem: ...` -> mem holds rss_mb, rss_delta_mb,
+        tree_rss_peak_mb (and py_peak_mb with tracemalloc) after the block.
+        """
+        w = {
+            "rss_start": rss_bytes(),
+            "tree_peak": tree_rss_bytes(),
+            "py_start": tracemalloc.get_traced_memory()[0] if self.trace_python else 0,
+            "py_peak": 0,
+        }
+        with self._lock:
+            self._watches.append(w)
+        stats = {}
+        try:
+            yield stats
+        finally:
+            self._sample()
+            with self._lock:
+                self._watches = [x for x in self._watches if x is not w]
+            rss = rss_bytes()
+            stats["rss_mb"] = round(rss / MB, 1)
+            stats["rss_delta_mb"] = round((rss - w["rss_start"]) / MB, 1)
+            stats["tree_rss_peak_mb"] = round(w["tree_peak"] / MB, 1)
+            if self.trace_python:
+                stats["py_peak_mb"] = round(max(0, w["py_peak"] - w["py_start"]) / MB, 1)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=1)
+
+
+_monitor = None
+
+def configure_memory(interval: float = 0.05, trace_python: bool = False):
+    global _monitor
+    _monitor = MemoryMonitor(interval, trace_python)
+    return _monitor
+
+def memory_watch():
+    """
+    `monitor.watch()` if a monitor is configured, otherwise a no-op that
+    yields an empty dict.
+    """
+    if _monitor is None:
+        return nullcontext({})
+    return _monitor.watch()
+
+
+def estimate_render_mb(renderer: str, probes: list, encode: dict) -> float:
+    """
+    Rough peak for one render, from canvas size, clip count and the
+    renderer's buffering:
+      moviepy  - every clip reader open at once plus float composite copies,
+      ffmpeg   - one filtergraph decoding all inputs, x264 lookahead,
+      stream   - the shared frame pool plus one decoder/encoder,
+      segments - `workers` independent single-clip encodes.
+    """
+    W = max(p["width"] for p in probes)
+    H = max(p["height"] for p in probes)
+    frame_mb = W * H * 3 / MB
+    n = len(probes) + 1
+    threads = encode.get("threads") or 4
+    x264_mb = frame_mb * (40 + 2 * threads)  # lookahead + reference frames
+
+    if renderer == "moviepy":
+        buffers = frame_mb * (n * 6 + 8)
+    elif renderer == "ffmpeg":
+        buffers = frame_mb * n * 8 + x264_mb
+    elif renderer == "stream":
+        workers = encode.get("workers") or max(1, (os.cpu_count() or 2) - 1)
+        pool = encode.get("pool_frames") or workers * 4
+        buffers = frame_mb * (pool + 16) + x264_mb + workers * 40
+    elif renderer == "segments":
+        workers = encode.get("workers") or min(n, os.cpu_count() or 1)
+        seg_threads = max(1, threads // workers)
+        buffers = workers * (frame_mb * (16 + 40 + 2 * seg_threads) + 30)
+    else:
+        raise ValueError(f"unknown renderer '{renderer}'")
+    return RENDER_BASE_MB[renderer] + buffers
+
+
+class MemoryProfile:
+    """
+    Observed render peaks per renderer, stored next to the outputs. The
+    ratio observed/estimated scales later estimates so the model tracks
+    what this host actually does.
+    """
+
+    def __init__(self, output_root: str):
+        self.path = os.path.join(output_root, PROFILE_NAME)
+        self._lock = threading.Lock()
+        self._data = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._data = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self._data = {}
+
+    def factor(self, renderer: str) -> float:
+        return self._data.get(renderer, {}).get("factor", 1.0)
+
+    def record(self, renderer: str, estimated_mb: float, observed_mb: float):
+        with self._lock:
+            entry = self._data.setdefault(renderer, {"factor": 1.0, "samples": 0})
+            ratio = observed_mb / estimated_mb if estimated_mb > 0 else 1.0
+            # exponential moving average, biased towards the worse case
+            entry["factor"] = max(ratio, 0.7 * entry["factor"] + 0.3 * ratio)
+            entry["samples"] += 1
+            entry["last_observed_mb"] = round(observed_mb, 1)
+
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._data, f, indent=4)
+            os.replace(tmp, self.path)
+
+
+def choose_render_strategy(renderer: str, probes: list, encode: dict, budget_mb: float, profile: MemoryProfile = None):
+    """
+    Keep `renderer` if its projected peak (current tree RSS + estimate)
+    fits `budget_mb`; otherwise fall back to segments rendered one at a
+    time to disk, the lowest-memory strategy. Returns
+    (renderer, encode, projected_mb).
+    """
+    base_mb = tree_rss_bytes() / MB
+
+    def _projected(r, e):
+        factor = profile.factor(r) if profile is not None else 1.0
+        return base_mb + estimate_render_mb(r, probes, e) * factor
+
+    projected = _projected(renderer, encode)
+    if budget_mb is None or projected <= budget_mb:
+        return renderer, encode, projected
+
+    fallback = {k: encode[k] for k in ("fps", "preset", "threads", "crf") if k in encode}
+    fallback["workers"] = 1
+    fallback_projected = _projected("segments", fallback)
+    print(
+        f"[Memory] {renderer} projected at {projected:.0f} MB > budget {budget_mb:.0f} MB, "
+        f"falling back to sequential segments ({fallback_projected:.0f} MB)"
+    )
+    if fallback_projected > budget_mb:
+        print("[Memory] sequential segments still exceed the budget; rendering anyway")
+    return "segments", fallback, fallback_projected
@@ -1,37 +1,49 @@
+import os
+import re
+import json
+import time
+import uuid
+import fcntl
+import atexit
 import smtplib
+import hashlib
+import argparse
+import threading
 import traceback
+from contextlib import contextmanager
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+DEFAULT_SPOOL_DIR = "./data/alerts"
+DEFAULT_SMTP_HOST = "smtp.gmail.com"
+DEFAULT_SMTP_PORT = 465
+# identical crashes within this many seconds go out as one email
+COALESCE_WINDOW = 60.0
+SUBJECT = "[AI Posts] Crash detected"
 
-def send_crash_email(
-    subject: str,
-    body: str,
-    to_email: str,
-    from_email: str,
-    app_password: str,
-):
+
+def build_message(subject: str, body: str, to_email: str, from_email: str) -> MIMEMultipart:
     msg = MIMEMultipart()
     msg["From"] = from_email
     msg["To"] = to_email
     msg["Subject"] = subject
 
     msg.attach(MIMEText(body, "plain", "utf-8"))
+    return msg
 
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-        server.login(from_email, app_password)
-        server.send_message(msg)
-
-def notify_crash(
-    exc: Exception,
-    context: dict,
-    to_email: str,
-    from_email: str,
-    app_password: str,
-):
-    tb = traceback.format_exc()
+def crash_fingerprint(exc: Exception) -> str:
+    """
+    Same exception type, same message modulo numbers/ids, raised from the
+    same place -> same fingerprint.
+    """
+    message = re.sub(r"0x[0-9a-f]+|\d+", "#", str(exc).lower())
+    frames = traceback.extract_tb(exc.__traceback__) if exc.__traceback__ else []
+    where = f"{frames[-1].filename}:{frames[-1].name}" if frames else ""
+    return hashlib.sha1(f"{type(exc).__name__}|{message}|{where}".encode("utf-8")).hexdigest()[:16]
 
-    body = f"""
+def format_crash(exc: Exception, context: dict) -> str:
+    tb = "".join(traceback.format_exception(type(exc), exc, exc.__traceback__))
+    return f"""
 [CRASH DETECTED]
 
 Exception:
@@ -44,10 +56,279 @@ Traceback:
 {tb}
 """
 
-    send_crash_email(
-        subject="[AI Posts] Crash detected",
-        body=body,
-        to_email=to_email,
-        from_email=from_email,
-        app_password=app_password,
-    )
+
+class AlertSpool:
+    """
+    On-disk queue of pending alerts, one JSON file each, written atomically.
+    Alerts survive a crash or an unreachable SMTP server and are delivered
+    by whichever process next runs a sender.
+    """
+
+    def __init__(self, spool_dir: str = DEFAULT_SPOOL_DIR):
+        self.dir = spool_dir
+        os.makedirs(spool_dir, exist_ok=True)
+
+    def put(self, alert: dict) -> str:
+        name = f"{time.time():.6f}_{uuid.uuid4().hex[:8]}.json"
+        path = os.path.join(self.dir, name)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(alert, f, ensure_ascii=False, default=str)
+        os.replace(tmp, path)
+        return path
+
+    def pending(self) -> list:
+        out = []
+        for name in sorted(os.listdir(self.dir)):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.dir, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    out.append((path, json.load(f)))
+            except (OSError, json.JSONDecodeError):
+                continue
+        return out
+
+    @contextmanager
+    def claim(self):
+        """
+        Non-blocking exclusive lock on the spool, so only one sender among
+        the processes sharing it reads and delivers at a time. Yields False
+        while another sender holds it.
+        """
+        with open(os.path.join(self.dir, ".lock"), "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def remove(self, paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def smtp_config(keys: dict, host: str = None, port: int = None):
+    """
+    SMTP settings from keys.json (ALERT_EMAIL, GMAIL_USER/GMAIL_APP_PASSWORD or
+    SMTP_USER/SMTP_PASSWORD, optional SMTP_HOST/SMTP_PORT), with CLI overrides.
+    None if alerts are not configured.
+    """
+    to_email = keys.get("ALERT_EMAIL")
+    user = keys.get("SMTP_USER") or keys.get("GMAIL_USER")
+    password = keys.get("SMTP_PASSWORD") or keys.get("GMAIL_APP_PASSWORD")
+    host = host or keys.get("SMTP_HOST") or DEFAULT_SMTP_HOST
+    port = int(port or keys.get("SMTP_PORT") or DEFAULT_SMTP_PORT)
+
+    # a custom host (e.g. a local relay) may not need credentials
+    if not to_email or (host == DEFAULT_SMTP_HOST and not (user and password)):
+        return None
+    return {
+        "host": host,
+        "port": port,
+        "ssl": bool(keys.get("SMTP_SSL", port == 465)),
+        "user": user,
+        "password": password,
+        "to_email": to_email,
+        "from_email": keys.get("ALERT_FROM") or user or f"alerts@{host}",
+    }
+
+
+class AlertSender:
+    """
+    Background thread draining an AlertSpool over one reused SMTP connection.
+    Alerts with the same fingerprint are held for `window` seconds and sent
+    as a single email; failures back off exponentially and leave the alerts
+    spooled.
+    """
+
+    def __init__(self, spool: AlertSpool, smtp: dict, window: float = COALESCE_WINDOW, tick: float = 5.0):
+        self.spool = spool
+        self.smtp = smtp
+        self.window = window
+        self.tick = tick
+        self.sent = 0
+        self.failures = 0
+        self._server = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="alert-sender", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def kick(self):
+        self._wake.set()
+
+    def _connection(self):
+        if self._server is not None:
+            try:
+                if self._server.noop()[0] == 250:
+                    return self._server
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._disconnect()
+
+        cls = smtplib.SMTP_SSL if self.smtp["ssl"] else smtplib.SMTP
+        server = cls(self.smtp["host"], self.smtp["port"], timeout=20)
+        server.ehlo()
+        # only use what the server offers, so a plain local relay works too
+        if not self.smtp["ssl"] and server.has_extn("starttls"):
+            server.starttls()
+            server.ehlo()
+        if self.smtp["user"] and self.smtp["password"] and server.has_extn("auth"):
+            server.login(self.smtp["user"], self.smtp["password"])
+        self._server = server
+        return server
+
+    def _disconnect(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+    def deliver(self, force: bool = False) -> int:
+        """
+        Send every fingerprint group whose window has closed (all of them
+        with `force`). Returns the number of emails sent; 0 if another
+        process's sender currently has the spool claimed.
+        """
+        with self.spool.claim() as claimed:
+            if not claimed:
+                return 0
+            return self._deliver(force)
+
+    def _deliver(self, force: bool) -> int:
+        groups = {}
+        for path, alert in self.spool.pending():
+            groups.setdefault(alert.get("fingerprint"), []).append((path, alert))
+
+        now = time.time()
+        sent = 0
+        for items in groups.values():
+            first = items[0][1]
+            if not force and now - first["created"] < self.window:
+                continue
+
+            subject = SUBJECT
+            body = first["body"]
+            if len(items) > 1:
+                subject += f" (x{len(items)})"
+                jobs = sorted({str(a["context"].get("job")) for _, a in items})
+                body += (
+                    f"\nSeen {len(items)} times between {time.ctime(first['created'])} "
+                    f"and {time.ctime(items[-1][1]['created'])}.\nJobs: {', '.join(jobs)}\n"
+                )
+
+            msg = build_message(subject, body, self.smtp["to_email"], self.smtp["from_email"])
+            self._connection().send_message(msg)
+            self.spool.remove(p for p, _ in items)
+            sent += 1
+            self.sent += 1
+        return sent
+
+    def _run(self):
+        delay = self.tick
+        while True:
+            stopping = self._stop.is_set()
+            try:
+                self.deliver(force=stopping)
+                delay = self.tick
+            except Exception as e:
+                self._disconnect()
+                self.failures += 1
+                delay = min(max(delay, 1.0) * 2, 300)
+                print(f"[Alert] delivery failed: {e!r}, alerts kept in {self.spool.dir}")
+                if stopping:
+                    break
+            if stopping:
+                break
+            self._wake.wait(delay)
+            self._wake.clear()
+        self._disconnect()
+
+    def close(self, timeout: float = 10.0):
+        """
+        Flush what is spooled (ignoring the window) and stop, waiting at
+        most `timeout` seconds.
+        """
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=timeout)
+
+
+_spool = None
+_sender = None
+
+def configure_alerts(spool_dir: str = DEFAULT_SPOOL_DIR, smtp: dict = None, window: float = COALESCE_WINDOW):
+    """
+    Set up the spool and, if `smtp` is given, start the background sender.
+    Leftover alerts from earlier runs are delivered too.
+    """
+    global _spool, _sender
+    _spool = AlertSpool(spool_dir)
+    if smtp is not None and _sender is None:
+        _sender = AlertSender(_spool, smtp, window=window).start()
+        atexit.register(shutdown_alerts)
+    return _sender
+
+def shutdown_alerts(timeout: float = 10.0):
+    global _sender
+    if _sender is not None:
+        _sender.close(timeout)
+        _sender = None
+
+def notify_crash(exc: Exception, context: dict) -> str:
+    """
+    Spool a crash alert and return immediately; delivery happens in the
+    background sender (or a later run if none is configured).
+    """
+    global _spool
+    if _spool is None:
+        _spool = AlertSpool()
+    path = _spool.put({
+        "created": time.time(),
+        "fingerprint": crash_fingerprint(exc),
+        "context": context,
+        "body": format_crash(exc, context),
+    })
+    if _sender is not None:
+        _sender.kick()
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_flush = sub.add_parser("flush")
+    p_flush.add_argument("--spool_dir", type=str, default=DEFAULT_SPOOL_DIR)
+    p_flush.add_argument("--keys_path", type=str, default="./data/keys.json")
+    p_flush.add_argument("--smtp_host", type=str, default=None)
+    p_flush.add_argument("--smtp_port", type=int, default=None)
+
+    args = parser.parse_args()
+
+    keys = {}
+    if os.path.exists(args.keys_path):
+        with open(args.keys_path, "r", encoding="utf-8") as f:
+            keys = json.load(f)
+    smtp = smtp_config(keys, host=args.smtp_host, port=args.smtp_port)
+    if smtp is None:
+        raise SystemExit("[Alert] SMTP is not configured")
+    spool = AlertSpool(args.spool_dir)
+    sender = AlertSender(spool, smtp)
+    n = sender.deliver(force=True)
+    sender._disconnect()
+    print(f"[Alert] sent {n} emails, {len(spool.pending())} alerts left")
@@ -0,0 +1,39 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PublishError(RuntimeError):
+    def __init__(self, errors: dict, results: dict):
+        self.errors = errors
+        self.results = results
+        detail = ", ".join(f"{name}: {err!r}" for name, err in errors.items())
+        super().__init__(f"publishing failed for {detail}")
+
+
+def publish_concurrently(uploads: dict) -> dict:
+    """
+    Run one zero-argument upload callable per platform at the same time.
+    Returns {platform: {"result": ..., "seconds": ...}}. A failing platform
+    does not cancel the others; PublishError is raised once all have finished.
+    """
+    def _timed(fn):
+        start = time.perf_counter()
+        result = fn()
+        return result, time.perf_counter() - start
+
+    results = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max(1, len(uploads))) as pool:
+        futures = {name: pool.submit(_timed, fn) for name, fn in uploads.items()}
+        for name, future in futures.items():
+            try:
+                result, seconds = future.result()
+                results[name] = {"result": result, "seconds": seconds}
+                print(f"[Publish] {name}: {result} ({seconds:.1f}s)")
+            except Exception as e:
+                errors[name] = e
+                print(f"[Publish] {name} failed: {e!r}")
+
+    if errors:
+        raise PublishError(errors, results)
+    return results
@@ -0,0 +1,391 @@
+import os
+import time
+import subprocess
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from moviepy import VideoFileClip, AudioFileClip, concatenate_videoclips
+
+from utils.bgm import fit_bgm
+from utils.manifest import inputs_hash
+from utils.trace import span, record_span
+from utils.video import (
+    probe_video,
+    make_intro,
+    overlay_top_caption,
+    ensure_intro_image,
+    intro_segment,
+    mezzanine_args,
+    render_label_image,
+    caption_font,
+)
+
+
+@contextmanager
+def render_timer(label: str):
+    """
+    Print wall and CPU time (including child processes such as ffmpeg)
+    spent inside the block.
+    """
+    wall_start = time.perf_counter()
+    t0 = os.times()
+    yield
+    t1 = os.times()
+    wall = time.perf_counter() - wall_start
+    cpu = (t1.user + t1.system + t1.children_user + t1.children_system) - (
+        t0.user + t0.system + t0.children_user + t0.children_system
+    )
+    print(f"[Render] {label}: wall {wall:.1f}s, cpu {cpu:.1f}s")
+
+def render_with_moviepy(
+    job: str,
+    animals: list,
+    video_paths: list,
+    bgm_path: str,
+    final_path: str,
+    intro_sec: float = 1.0,
+    fps: float = 24,
+    preset: str = "medium",
+    threads: int = 4,
+    crf: int = None,
+    intro_cache_dir: str = None,
+):
+    intro_clip = make_intro(video_paths[0], job, intro_sec=intro_sec, cache_dir=intro_cache_dir)
+
+    animal_clips = []
+    caption_stats = []
+    for idx, (animal, vp) in enumerate(zip(animals, video_paths), start=1):
+        c = VideoFileClip(vp)
+        stats = {"frames": 0, "seconds": 0.0}
+        c = overlay_top_caption(c, f"{idx}. {animal.title()}", stats=stats)
+        animal_clips.append(c)
+        caption_stats.append((animal, stats))
+
+    with span("concat", job=job, clips=len(animal_clips) + 1):
+        final = concatenate_videoclips([intro_clip] + animal_clips, method="compose")
+
+    # one pre-fitted flat WAV instead of a chain of lazily looped clips
+    fitted_path = fit_bgm(bgm_path, final.duration, os.path.dirname(os.path.abspath(final_path)))
+    audio = AudioFileClip(fitted_path)
+    final = final.with_audio(audio)
+
+    with span("write_videofile", job=job, renderer="moviepy", preset=preset, threads=threads) as sp:
+        final.write_videofile(
+            final_path,
+            codec="libx264",
+            audio_codec="aac",
+            fps=fps,
+            audio=True,
+            preset=preset,
+            threads=threads,
+            ffmpeg_params=["-crf", str(crf)] if crf is not None else None,
+        )
+        sp["frames"] = int(round(final.duration * fps))
+        sp["bytes"] = os.path.getsize(final_path)
+
+    for animal, stats in caption_stats:
+        record_span(
+            "overlay_top_caption",
+            stats["seconds"],
+            job=job,
+            animal=animal,
+            frames=stats["frames"],
+        )
+
+    # close resources
+    audio.close()
+    final.close()
+    for c in animal_clips:
+        c.close()
+
+    return final_path
+
+def build_ffmpeg_command(
+    intro_image_path: str,
+    intro_sec: float,
+    video_paths: list,
+    caption_paths: list,
+    bgm_path: str,
+    final_path: str,
+    size,
+    total_duration: float,
+    fps: float = 24,
+    preset: str = "medium",
+    threads: int = 4,
+    crf: int = None,
+    out_height: int = None,
+) -> list:
+    """
+    Single ffmpeg invocation equivalent to the moviepy path:
+    intro still + captioned clips, concatenated onto a W x H canvas
+    (like method="compose"), muxed with the pre-fitted `bgm_path`.
+    `out_height` downscales the concatenated video (previews).
+    """
+    W, H = size
+    pad = f"pad={W}:{H}:(ow-iw)/2:(oh-ih)/2:color=black,setsar=1,fps={fps},format=yuv420p"
+
+    cmd = ["ffmpeg", "-y", "-loglevel", "error"]
+    cmd += ["-loop", "1", "-framerate", str(fps), "-t", f"{intro_sec}", "-i", intro_image_path]
+    for vp, cp in zip(video_paths, caption_paths):
+        cmd += ["-i", vp, "-i", cp]
+    bgm_index = 1 + 2 * len(video_paths)
+    cmd += ["-i", bgm_path]
+
+    filters = [f"[0:v]{pad}[v0]"]
+    for i in range(len(video_paths)):
+        vi, ci = 1 + 2 * i, 2 + 2 * i
+        filters.append(f"[{vi}:v][{ci}:v]overlay=0:0,{pad}[v{i + 1}]")
+    labels = "".join(f"[v{i}]" for i in range(len(video_paths) + 1))
+    if out_height:
+        filters.append(f"{labels}concat=n={len(video_paths) + 1}:v=1:a=0[vcat]")
+        filters.append(f"[vcat]scale=-2:{out_height}[vout]")
+    else:
+        filters.append(f"{labels}concat=n={len(video_paths) + 1}:v=1:a=0[vout]")
+    filters.append(f"[{bgm_index}:a]atrim=0:{total_duration:.3f},asetpts=PTS-STARTPTS[aout]")
+
+    cmd += ["-filter_complex", ";".join(filters)]
+    cmd += ["-map", "[vout]", "-map", "[aout]"]
+    cmd += ["-c:v", "libx264", "-preset", preset, "-threads", str(threads)]
+    if crf is not None:
+        cmd += ["-crf", str(crf)]
+    cmd += ["-c:a", "aac", "-t", f"{total_duration:.3f}", final_path]
+    return cmd
+
+def prepare_ffmpeg_inputs(job: str, animals: list, video_paths: list, work_dir: str):
+    """
+    Pre-render the intro still and one full-frame caption PNG per clip.
+    The intro is the content-keyed still cached in `work_dir`, used in
+    place rather than copied. Returns (intro_image_path, caption_paths,
+    probes, fps).
+    """
+    os.makedirs(work_dir, exist_ok=True)
+
+    with span("make_intro", job=job, renderer="ffmpeg"):
+        intro_image_path, fps = ensure_intro_image(video_paths[0], job, work_dir)
+
+    probes = []
+    caption_paths = []
+    for idx, (animal, vp) in enumerate(zip(animals, video_paths), start=1):
+        probe = probe_video(vp)
+        probes.append(probe)
+
+        size = (probe["width"], probe["height"])
+        with span("overlay_top_caption", job=job, animal=animal, renderer="ffmpeg"):
+            label = render_label_image(f"{idx}. {animal.title()}", caption_font(size[0]), size)
+            caption_path = os.path.join(work_dir, f"caption_{idx}.png")
+            label.save(caption_path)
+        caption_paths.append(caption_path)
+
+    return intro_image_path, caption_paths, probes, fps
+
+def render_with_ffmpeg(
+    intro_image_path: str,
+    intro_sec: float,
+    video_paths: list,
+    caption_paths: list,
+    probes: list,
+    bgm_path: str,
+    final_path: str,
+    fps: float = 24,
+    preset: str = "medium",
+    threads: int = 4,
+    crf: int = None,
+):
+    size = (max(p["width"] for p in probes), max(p["height"] for p in probes))
+    total = intro_sec + sum(p["duration"] for p in probes)
+    fitted_path = fit_bgm(bgm_path, total, os.path.dirname(os.path.abspath(final_path)))
+
+    cmd = build_ffmpeg_command(
+        intro_image_path,
+        intro_sec,
+        video_paths,
+        caption_paths,
+        fitted_path,
+        final_path,
+        size=size,
+        total_duration=total,
+        fps=fps,
+        preset=preset,
+        threads=threads,
+        crf=crf,
+    )
+    with span("write_videofile", renderer="ffmpeg", preset=preset, threads=threads) as sp:
+        subprocess.run(cmd, check=True)
+        sp["frames"] = int(round(total * fps))
+        sp["bytes"] = os.path.getsize(final_path)
+    return final_path
+
+PREVIEW_HEIGHT = 360
+PREVIEW_FPS = 12
+PREVIEW_CRF = 30
+CONTACT_SHEET_FRAMES = 6
+
+def render_preview(
+    intro_image_path: str,
+    intro_sec: float,
+    video_paths: list,
+    caption_paths: list,
+    probes: list,
+    bgm_path: str,
+    preview_path: str,
+    height: int = PREVIEW_HEIGHT,
+    fps: float = PREVIEW_FPS,
+):
+    """
+    QA draft: the same intro, captions and BGM as the ffmpeg renderer, but
+    downscaled, at a low frame rate and with preset=ultrafast.
+    Returns the segment (start, duration) list for contact sheets.
+    """
+    size = (max(p["width"] for p in probes), max(p["height"] for p in probes))
+    total = intro_sec + sum(p["duration"] for p in probes)
+    fitted_path = fit_bgm(bgm_path, total, os.path.dirname(os.path.abspath(preview_path)))
+
+    cmd = build_ffmpeg_command(
+        intro_image_path,
+        intro_sec,
+        video_paths,
+        caption_paths,
+        fitted_path,
+        preview_path,
+        size=size,
+        total_duration=total,
+        fps=fps,
+        preset="ultrafast",
+        threads=0,
+        crf=PREVIEW_CRF,
+        out_height=height,
+    )
+    with span("write_videofile", renderer="preview", height=height, fps=fps) as sp:
+        subprocess.run(cmd, check=True)
+        sp["bytes"] = os.path.getsize(preview_path)
+
+    segments = [(0.0, intro_sec)]
+    start = intro_sec
+    for p in probes:
+        segments.append((start, p["duration"]))
+        start += p["duration"]
+    return segments
+
+def contact_sheet(video_path: str, start: float, duration: float, sheet_path: str, frames: int = CONTACT_SHEET_FRAMES):
+    """
+    One JPEG with `frames` evenly spaced frames of [start, start + duration], side by side.
+    """
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-ss", f"{start:.3f}", "-t", f"{duration:.3f}", "-i", video_path,
+        "-vf", f"fps={frames / duration:.4f},tile={frames}x1",
+        "-frames:v", "1", "-q:v", "3",
+        sheet_path,
+    ]
+    subprocess.run(cmd, check=True)
+    return sheet_path
+
+def _encode_segment(cmd: list, seg_path: str):
+    tmp = seg_path + ".part.mp4"
+    subprocess.run(cmd + [tmp], check=True)
+    os.replace(tmp, seg_path)
+    return seg_path
+
+def segment_commands(
+    video_paths: list,
+    caption_paths: list,
+    size,
+    fps: float = 24,
+    preset: str = "medium",
+    threads: int = 1,
+    crf: int = None,
+) -> list:
+    """
+    One ffmpeg command (without output path) per captioned clip segment,
+    encoded with the same mezzanine settings as `intro_segment` so all of
+    them can be concatenated with stream copy.
+    """
+    pad, encode = mezzanine_args(size, fps, preset, threads, crf)
+    base = ["ffmpeg", "-y", "-loglevel", "error"]
+    return [
+        base
+        + ["-i", vp, "-i", cp]
+        + ["-filter_complex", f"[0:v][1:v]overlay=0:0,{pad}[v]", "-map", "[v]"]
+        + encode
+        for vp, cp in zip(video_paths, caption_paths)
+    ]
+
+def render_segmented(
+    intro_image_path: str,
+    intro_sec: float,
+    video_paths: list,
+    caption_paths: list,
+    probes: list,
+    bgm_path: str,
+    final_path: str,
+    fps: float = 24,
+    preset: str = "medium",
+    threads: int = 4,
+    crf: int = None,
+    workers: int = None,
+    segment_dir: str = None,
+):
+    """
+    Encode the intro and every captioned clip as separate mezzanine files in
+    parallel, each named by the hash of its inputs, then join them with the
+    concat demuxer (stream copy) and mux the fitted BGM. A rerun re-encodes
+    only the segments whose inputs changed; a new BGM re-encodes none.
+    """
+    size = (max(p["width"] for p in probes), max(p["height"] for p in probes))
+    total = intro_sec + sum(p["duration"] for p in probes)
+    out_dir = os.path.dirname(os.path.abspath(final_path))
+    segment_dir = segment_dir or os.path.join(out_dir, "segments")
+    os.makedirs(segment_dir, exist_ok=True)
+
+    n_segments = len(video_paths) + 1
+    workers = workers or min(n_segments, os.cpu_count() or 1)
+    seg_threads = max(1, threads // workers)
+    cmds = segment_commands(
+        video_paths, caption_paths, size,
+        fps=fps, preset=preset, threads=seg_threads, crf=crf,
+    )
+    encode_key = (size, fps, preset, crf)
+
+    seg_paths = []
+    todo = []
+    for cmd, parts in zip(cmds, zip(video_paths, caption_paths)):
+        key = inputs_hash(*parts, encode_key)[:16]
+        seg_path = os.path.join(segment_dir, f"seg_{key}.mp4")
+        seg_paths.append(seg_path)
+        if not os.path.exists(seg_path):
+            todo.append((cmd, seg_path))
+
+    with span("encode_segments", renderer="segments", segments=n_segments,
+              encoded=len(todo), workers=workers, preset=preset) as sp:
+        # each job is an ffmpeg child process; threads only wait on them
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # the intro is cached next to its still and shared by every render
+            intro = pool.submit(
+                intro_segment, intro_image_path, intro_sec, size,
+                fps=fps, preset=preset, threads=seg_threads, crf=crf,
+            )
+            for f in [pool.submit(_encode_segment, cmd, path) for cmd, path in todo]:
+                f.result()
+            seg_paths.insert(0, intro.result())
+        sp["reused"] = len(video_paths) - len(todo)
+    print(f"[Render] segments: {len(todo)} clips encoded, {len(video_paths) - len(todo)} reused")
+
+    fitted_path = fit_bgm(bgm_path, total, out_dir)
+    list_path = os.path.join(segment_dir, "concat.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        for seg_path in seg_paths:
+            f.write(f"file '{os.path.abspath(seg_path)}'\n")
+
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-i", list_path,
+        "-i", fitted_path,
+        "-map", "0:v", "-map", "1:a",
+        "-c:v", "copy", "-c:a", "aac",
+        "-t", f"{total:.3f}", "-movflags", "+faststart",
+        final_path,
+    ]
+    with span("write_videofile", renderer="segments") as sp:
+        subprocess.run(cmd, check=True)
+        sp["frames"] = int(round(total * fps))
+        sp["bytes"] = os.path.getsize(final_path)
+    return final_path
@@ -0,0 +1,322 @@
+import os
+import time
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# rate: tokens/sec, burst: bucket size, max_in_flight: concurrent calls host-wide
+DEFAULT_PROVIDER_LIMITS = {
+    "replicate": {"rate": 1.0, "burst": 4, "max_in_flight": 6},
+    "suno": {"rate": 0.5, "burst": 2, "max_in_flight": 2},
+    "openai": {"rate": 1.0, "burst": 2, "max_in_flight": 2},
+    "youtube": {"rate": 0.2, "burst": 1, "max_in_flight": 1},
+    "tiktok": {"rate": 0.2, "burst": 1, "max_in_flight": 1},
+}
+
+DEFAULT_LIMITS_DB = "./data/provider_limits.db"
+
+# share of each provider's max_in_flight kept free for the job being rendered;
+# stages of prefetched jobs only get the slots beyond it
+FOREGROUND_RESERVE = 0.5
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ProviderLimits:
+    """
+    Per-provider token bucket + max in-flight count, shared by every process
+    on the host through one SQLite file. Slots held by dead processes are
+    reclaimed on the next acquire.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_LIMITS_DB, limits: dict = None):
+        self.db_path = db_path
+        self.limits = dict(DEFAULT_PROVIDER_LIMITS)
+        self.limits.update(limits or {})
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            db_path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS buckets (
+                provider TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS holders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, provider TEXT, pid INTEGER, since REAL
+            );
+            CREATE TABLE IF NOT EXISTS waiters (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, provider TEXT, pid INTEGER, since REAL
+            );
+            CREATE TABLE IF NOT EXISTS stats (
+                provider TEXT PRIMARY KEY,
+                acquired INTEGER NOT NULL DEFAULT 0,
+                total_wait REAL NOT NULL DEFAULT 0,
+                max_wait REAL NOT NULL DEFAULT 0
+            );
+            """
+        )
+
+    def _purge_dead(self):
+        pids = {r[0] for r in self._conn.execute("SELECT pid FROM holders UNION SELECT pid FROM waiters")}
+        for pid in pids:
+            if not _pid_alive(pid):
+                self._conn.execute("DELETE FROM holders WHERE pid = ?", (pid,))
+                self._conn.execute("DELETE FROM waiters WHERE pid = ?", (pid,))
+
+    def _try_acquire(self, provider: str, cfg: dict, waiter_id: int, waited_since: float, background: bool = False):
+        """
+        One transaction: refill the bucket and take a token + slot if possible.
+        Background callers stop short of the FOREGROUND_RESERVE slots.
+        Returns (holder_id, None) on success or (None, seconds_to_sleep).
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._purge_dead()
+
+                row = self._conn.execute(
+                    "SELECT tokens, updated FROM buckets WHERE provider = ?", (provider,)
+                ).fetchone()
+                tokens, updated = row if row else (float(cfg["burst"]), now)
+                tokens = min(float(cfg["burst"]), tokens + (now - updated) * cfg["rate"])
+
+                in_flight = self._conn.execute(
+                    "SELECT COUNT(*) FROM holders WHERE provider = ?", (provider,)
+                ).fetchone()[0]
+
+                max_in_flight = cfg["max_in_flight"]
+                if background:
+                    max_in_flight -= max(1, int(max_in_flight * FOREGROUND_RESERVE))
+
+                holder_id = None
+                if tokens >= 1.0 and in_flight < max_in_flight:
+                    tokens -= 1.0
+                    cur = self._conn.execute(
+                        "INSERT INTO holders (provider, pid, since) VALUES (?, ?, ?)",
+                        (provider, os.getpid(), now),
+                    )
+                    holder_id = cur.lastrowid
+                    wait = now - waited_since
+                    self._conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+                    self._conn.execute(
+                        "INSERT INTO stats (provider, acquired, total_wait, max_wait) VALUES (?, 1, ?, ?) "
+                        "ON CONFLICT(provider) DO UPDATE SET acquired = acquired + 1, "
+                        "total_wait = total_wait + excluded.total_wait, "
+                        "max_wait = MAX(max_wait, excluded.max_wait)",
+                        (provider, wait, wait),
+                    )
+
+                self._conn.execute(
+                    "INSERT INTO buckets (provider, tokens, updated) VALUES (?, ?, ?) "
+                    "ON CONFLICT(provider) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                    (provider, tokens, now),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        if holder_id is not None:
+            return holder_id, None
+        if tokens < 1.0:
+            return None, max(0.05, (1.0 - tokens) / cfg["rate"])
+        return None, 0.25
+
+    def acquire(self, provider: str, background=None):
+        """
+        `background`, if given, is called before every attempt; while it
+        returns True the caller only competes for non-reserved slots.
+        """
+        cfg = self.limits.get(provider)
+        if cfg is None:
+            return None
+
+        since = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO waiters (provider, pid, since) VALUES (?, ?, ?)",
+                (provider, os.getpid(), since),
+            )
+            waiter_id = cur.lastrowid
+
+        try:
+            while True:
+                holder_id, delay = self._try_acquire(
+                    provider, cfg, waiter_id, since, background=bool(background and background())
+                )
+                if holder_id is not None:
+                    return holder_id
+                time.sleep(delay)
+        except BaseException:
+            with self._lock:
+                self._conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+            raise
+
+    def release(self, holder_id):
+        if holder_id is None:
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM holders WHERE id = ?", (holder_id,))
+
+    @contextmanager
+    def slot(self, provider: str, background=None):
+        holder_id = self.acquire(provider, background)
+        try:
+            yield
+        finally:
+            self.release(holder_id)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            in_flight = dict(self._conn.execute(
+                "SELECT provider, COUNT(*) FROM holders GROUP BY provider"
+            ).fetchall())
+            waiting = dict(self._conn.execute(
+                "SELECT provider, COUNT(*) FROM waiters GROUP BY provider"
+            ).fetchall())
+            stats = {
+                r[0]: r[1:] for r in self._conn.execute(
+                    "SELECT provider, acquired, total_wait, max_wait FROM stats"
+                ).fetchall()
+            }
+
+        out = {}
+        for provider in sorted(set(self.limits) | set(stats)):
+            acquired, total_wait, max_wait = stats.get(provider, (0, 0.0, 0.0))
+            out[provider] = {
+                "in_flight": in_flight.get(provider, 0),
+                "queue_depth": waiting.get(provider, 0),
+                "acquired": acquired,
+                "avg_wait_s": total_wait / acquired if acquired else 0.0,
+                "max_wait_s": max_wait,
+            }
+        return out
+
+    def close(self):
+        self._conn.close()
+
+
+_limits = None
+_priority = threading.local()
+
+def with_priority(foreground: threading.Event, fn):
+    """
+    Wrap a stage so the provider slots it takes count as background until
+    `foreground` is set, i.e. until its job becomes the one being rendered.
+    """
+    def _run(*args, **kwargs):
+        _priority.foreground = foreground
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _priority.foreground = None
+    return _run
+
+def _is_background() -> bool:
+    foreground = getattr(_priority, "foreground", None)
+    return foreground is not None and not foreground.is_set()
+
+def configure_limits(db_path: str = DEFAULT_LIMITS_DB, limits: dict = None):
+    global _limits
+    _limits = ProviderLimits(db_path, limits)
+    return _limits
+
+@contextmanager
+def provider_slot(provider: str):
+    """
+    Hold one rate-limited slot for `provider` while the block runs.
+    A no-op until `configure_limits` has been called.
+    """
+    if _limits is None:
+        yield
+        return
+    with _limits.slot(provider, background=_is_background):
+        yield
+
+def print_metrics(metrics: dict):
+    print(f"{'provider':<12}{'in_flight':>10}{'queued':>8}{'acquired':>10}{'avg_wait':>10}{'max_wait':>10}")
+    for provider, m in metrics.items():
+        print(
+            f"{provider:<12}{m['in_flight']:>10}{m['queue_depth']:>8}{m['acquired']:>10}"
+            f"{m['avg_wait_s']:>9.1f}s{m['max_wait_s']:>9.1f}s"
+        )
+
+
+class StageScheduler:
+    """
+    Runs pipeline stages on a thread pool as soon as the futures they depend
+    on are resolved. Future arguments are replaced by their results, and a
+    failed dependency fails every stage downstream of it.
+    """
+
+    def __init__(self, max_workers: int = 8):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, name: str, fn, *args, **kwargs) -> Future:
+        result = Future()
+        deps = [a for a in list(args) + list(kwargs.values()) if isinstance(a, Future)]
+        state = {"remaining": len(deps), "settled": False}
+        lock = threading.Lock()
+
+        def _run():
+            try:
+                a = [x.result() if isinstance(x, Future) else x for x in args]
+                kw = {k: v.result() if isinstance(v, Future) else v for k, v in kwargs.items()}
+                result.set_result(fn(*a, **kw))
+            except BaseException as e:
+                result.set_exception(e)
+
+        def _dep_done(dep):
+            error = dep.exception() if not dep.cancelled() else RuntimeError(f"dependency of {name} cancelled")
+            with lock:
+                if state["settled"]:
+                    return
+                if error is None:
+                    state["remaining"] -= 1
+                    if state["remaining"] > 0:
+                        return
+                state["settled"] = True
+
+            result.set_running_or_notify_cancel()
+            if error is not None:
+                result.set_exception(error)
+            else:
+                self._pool.submit(_run)
+
+        if not deps:
+            result.set_running_or_notify_cancel()
+            self._pool.submit(_run)
+        for dep in deps:
+            dep.add_done_callback(_dep_done)
+        return result
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--limits_db", type=str, default=DEFAULT_LIMITS_DB)
+    parser.add_argument("--watch", type=float, default=0)
+    args = parser.parse_args()
+
+    limits = ProviderLimits(args.limits_db)
+    while True:
+        print_metrics(limits.metrics())
+        if args.watch <= 0:
+            break
+        time.sleep(args.watch)
+        print()
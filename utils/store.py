@@ -0,0 +1,184 @@
+import os
+import json
+import sqlite3
+import argparse
+import threading
+
+
+class JsonStore:
+    """
+    The original `{concept}.json` dataset, kept fully in memory and rewritten
+    atomically (temp file + rename) on every mutation.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+        else:
+            self._data = {}
+            self._save()
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, indent=4, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def __contains__(self, job: str) -> bool:
+        return job in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+    def items(self):
+        with self._lock:
+            return list(self._data.items())
+
+    def update(self, new_data: dict):
+        with self._lock:
+            self._data.update(new_data)
+            self._save()
+
+    def find_unused(self):
+        with self._lock:
+            return [
+                (job, value.get("animals", []))
+                for job, value in self._data.items()
+                if isinstance(value, dict) and value.get("used") is False
+            ]
+
+    def mark_used(self, job: str) -> bool:
+        with self._lock:
+            entry = self._data.get(job)
+            if not isinstance(entry, dict) or entry.get("used") is not False:
+                return False
+            entry["used"] = True
+            self._save()
+        return True
+
+    def close(self):
+        pass
+
+
+class SqliteStore:
+    """
+    SQLite-backed dataset. `used` is indexed so unused-job lookups never
+    touch used rows, and marking a job as used is a single transaction.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    name TEXT PRIMARY KEY,
+                    animals TEXT NOT NULL,
+                    used INTEGER NOT NULL DEFAULT 0
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_used ON jobs(used)")
+
+    def __contains__(self, job: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM jobs WHERE name = ?", (job,)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def keys(self):
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT name FROM jobs")]
+
+    def items(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT name, animals, used FROM jobs").fetchall()
+        return [
+            (name, {"animals": json.loads(animals), "used": bool(used)})
+            for name, animals, used in rows
+        ]
+
+    def update(self, new_data: dict):
+        rows = [
+            (job, json.dumps(value.get("animals", []), ensure_ascii=False), int(bool(value.get("used"))))
+            for job, value in new_data.items()
+            if isinstance(value, dict)
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO jobs (name, animals, used) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET animals = excluded.animals, used = excluded.used",
+                rows,
+            )
+
+    def find_unused(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT name, animals FROM jobs WHERE used = 0").fetchall()
+        return [(name, json.loads(animals)) for name, animals in rows]
+
+    def mark_used(self, job: str) -> bool:
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "UPDATE jobs SET used = 1 WHERE name = ? AND used = 0", (job,)
+            )
+        return cur.rowcount == 1
+
+    def close(self):
+        self._conn.close()
+
+
+def open_store(path: str):
+    if path.endswith((".db", ".sqlite", ".sqlite3")):
+        return SqliteStore(path)
+    return JsonStore(path)
+
+def import_json(json_path: str, db_path: str) -> int:
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    store = SqliteStore(db_path)
+    store.update(data)
+    store.close()
+    return len(data)
+
+def export_json(db_path: str, json_path: str) -> int:
+    store = SqliteStore(db_path)
+    data = dict(store.items())
+    store.close()
+
+    tmp = json_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+    os.replace(tmp, json_path)
+    return len(data)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_import = sub.add_parser("import")
+    p_import.add_argument("json_path", type=str)
+    p_import.add_argument("db_path", type=str)
+
+    p_export = sub.add_parser("export")
+    p_export.add_argument("db_path", type=str)
+    p_export.add_argument("json_path", type=str)
+
+    args = parser.parse_args()
+
+    if args.command == "import":
+        n = import_json(args.json_path, args.db_path)
+        print(f"[DATA] imported {n} jobs into {args.db_path}")
+    else:
+        n = export_json(args.db_path, args.json_path)
+        print(f"[DATA] exported {n} jobs to {args.json_path}")
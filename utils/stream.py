@@ -0,0 +1,247 @@
+import os
+import queue
+import threading
+import subprocess
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from utils.bgm import fit_bgm
+from utils.trace import span
+from utils.video import (
+    probe_video,
+    render_intro_image,
+    render_label_sprite,
+    caption_font,
+    composite_sprite_inplace,
+)
+
+# per-process state of compositing workers (set by _init_worker)
+_worker = {}
+# seconds to wait on one frame's caption before giving up on the pool
+COMPOSITE_TIMEOUT = 60.0
+
+
+def _init_worker(shm_name: str, shape, sprites: list):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker["shm"] = shm
+    _worker["frames"] = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    _worker["sprites"] = sprites
+
+def _composite_slot(slot: int, sprite_index: int) -> int:
+    composite_sprite_inplace(_worker["frames"][slot], _worker["sprites"][sprite_index])
+    return slot
+
+def _wait_composite(pending):
+    """
+    Wait for one compositing task. A worker that dies breaks the executor
+    (BrokenProcessPool) instead of silently dropping its task, and a hang
+    is bounded by COMPOSITE_TIMEOUT.
+    """
+    try:
+        return pending.result(timeout=COMPOSITE_TIMEOUT)
+    except BrokenProcessPool as e:
+        raise RuntimeError("[Stream] a compositing worker died") from e
+    except FutureTimeout as e:
+        raise TimeoutError(f"[Stream] frame not composited after {COMPOSITE_TIMEOUT:.0f}s") from e
+
+def _read_exact(stream, view: memoryview) -> int:
+    got = 0
+    while got < len(view):
+        n = stream.readinto(view[got:])
+        if not n:
+            break
+        got += n
+    return got
+
+def _decoder(path: str, size, fps: float) -> subprocess.Popen:
+    W, H = size
+    cmd = [
+        "ffmpeg", "-v", "error",
+        "-i", path,
+        "-vf", f"pad={W}:{H}:(ow-iw)/2:(oh-ih)/2:color=black,fps={fps}",
+        "-f", "rawvideo", "-pix_fmt", "rgb24",
+        "-",
+    ]
+    return subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=0)
+
+def _encoder(final_path: str, size, fps: float, audio_path: str, preset: str, threads: int, crf: int):
+    W, H = size
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{W}x{H}", "-r", str(fps), "-i", "-",
+        "-i", audio_path,
+        "-map", "0:v", "-map", "1:a",
+        "-c:v", "libx264", "-preset", preset, "-threads", str(threads), "-pix_fmt", "yuv420p",
+    ]
+    if crf is not None:
+        cmd += ["-crf", str(crf)]
+    cmd += ["-c:a", "aac", "-shortest", final_path]
+    return subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+def _centered(img: np.ndarray, size) -> np.ndarray:
+    W, H = size
+    h, w = img.shape[:2]
+    canvas = np.zeros((H, W, 3), dtype=np.uint8)
+    y, x = (H - h) // 2, (W - w) // 2
+    canvas[y:y + h, x:x + w] = img
+    return canvas
+
+def render_with_stream(
+    job: str,
+    animals: list,
+    video_paths: list,
+    bgm_path: str,
+    final_path: str,
+    intro_sec: float = 1.0,
+    fps: float = 24,
+    preset: str = "medium",
+    threads: int = 4,
+    crf: int = None,
+    workers: int = None,
+    pool_frames: int = None,
+    intro_cache_dir: str = None,
+):
+    """
+    Streaming renderer with bounded memory:
+      - a read-ahead thread decodes one clip at a time (ffmpeg -> raw RGB)
+        straight into a fixed pool of frame slots in shared memory,
+      - a process pool composites captions in place on those slots, so
+        frames are never pickled,
+      - the main thread feeds slots to the x264 encoder in order and only
+        then recycles them, which back-pressures the decoder.
+    Peak memory is `pool_frames` frames no matter how many clips there are.
+    """
+    probes = [probe_video(vp) for vp in video_paths]
+    size = (max(p["width"] for p in probes), max(p["height"] for p in probes))
+    W, H = size
+    total = intro_sec + sum(p["duration"] for p in probes)
+    fitted_path = fit_bgm(bgm_path, total, os.path.dirname(os.path.abspath(final_path)))
+
+    intro_img, _ = render_intro_image(video_paths[0], job, cache_dir=intro_cache_dir)
+    intro = _centered(np.asarray(intro_img.convert("RGB")), size)
+
+    sprites = []
+    for idx, (animal, probe) in enumerate(zip(animals, probes), start=1):
+        w, h = probe["width"], probe["height"]
+        x, y, rgb, alpha = render_label_sprite(f"{idx}. {animal.title()}", caption_font(w), (w, h))
+        sprites.append((x + (W - w) // 2, y + (H - h) // 2, rgb, alpha))
+
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    n_slots = pool_frames or workers * 4
+    frame_bytes = W * H * 3
+
+    shm = shared_memory.SharedMemory(create=True, size=n_slots * frame_bytes)
+    frames = np.ndarray((n_slots, H, W, 3), dtype=np.uint8, buffer=shm.buf)
+    free = queue.Queue()
+    for slot in range(n_slots):
+        free.put(slot)
+    ordered = queue.Queue()
+    errors = []
+    stop = threading.Event()
+
+    # forkserver, not fork: this process already runs scheduler, monitor and
+    # sender threads whose locks a forked child could inherit mid-acquire
+    pool = ProcessPoolExecutor(
+        workers,
+        mp_context=mp.get_context("forkserver"),
+        initializer=_init_worker,
+        initargs=(shm.name, frames.shape, sprites),
+    )
+    encoder = _encoder(final_path, size, fps, fitted_path, preset, threads, crf)
+    decoders = []
+
+    def _next_slot():
+        slot = free.get()
+        return None if stop.is_set() else slot
+
+    def _reader():
+        try:
+            for _ in range(int(round(intro_sec * fps))):
+                slot = _next_slot()
+                if slot is None:
+                    return
+                np.copyto(frames[slot], intro)
+                ordered.put((slot, None))
+
+            for idx, vp in enumerate(video_paths):
+                if stop.is_set():
+                    return
+                dec = _decoder(vp, size, fps)
+                decoders.append(dec)
+                try:
+                    while True:
+                        slot = _next_slot()
+                        if slot is None:
+                            return
+                        view = memoryview(frames[slot]).cast("B")
+                        got = _read_exact(dec.stdout, view)
+                        view.release()
+                        if got < frame_bytes:
+                            free.put(slot)
+                            break
+                        ordered.put((slot, pool.submit(_composite_slot, slot, idx)))
+                finally:
+                    dec.stdout.close()
+                    dec.wait()
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            ordered.put(None)
+
+    reader = threading.Thread(target=_reader, name="stream-reader", daemon=True)
+
+    with span("write_videofile", job=job, renderer="stream", preset=preset, threads=threads, workers=workers) as sp:
+        written = 0
+        ok = False
+        try:
+            reader.start()
+            while True:
+                item = ordered.get()
+                if item is None:
+                    break
+                slot, pending = item
+                if pending is not None:
+                    _wait_composite(pending)
+                view = memoryview(frames[slot]).cast("B")
+                encoder.stdin.write(view)
+                view.release()
+                free.put(slot)
+                written += 1
+
+            encoder.stdin.close()
+            if encoder.wait() != 0:
+                raise RuntimeError(f"[Stream] encoder exited with {encoder.returncode}")
+            if errors:
+                raise errors[0]
+            ok = True
+        finally:
+            stop.set()
+            if encoder.poll() is None:
+                encoder.kill()
+                encoder.wait()
+            # unblock the reader whether it waits for a slot or on a decoder
+            for slot in range(n_slots):
+                free.put(slot)
+            for dec in decoders:
+                if dec.poll() is None:
+                    dec.kill()
+            # the reader writes into the shared buffer, so it must be gone
+            # before the memory is released
+            reader.join()
+            # after a failure a worker may be stuck; don't wait for it. Its own
+            # mapping of the segment stays valid after the unlink below
+            pool.shutdown(wait=ok, cancel_futures=True)
+            # drop our ndarray view, otherwise shm.close() sees an exported buffer
+            frames = None
+            shm.close()
+            shm.unlink()
+
+        sp["frames"] = written
+        sp["bytes"] = os.path.getsize(final_path)
+        sp["pool_frames"] = n_slots
+
+    return final_path
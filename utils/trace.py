@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import uuid
+import argparse
+import resource
+import threading
+from contextlib import contextmanager
+
+from utils.memory import memory_watch
+
+PROM_PREFIX = "video_pipeline"
+
+
+def _child_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Tracer:
+    """
+    Collects named spans and writes each finished span as one JSON line.
+    Per-span-name totals are mirrored to a Prometheus textfile
+    (node_exporter textfile collector format).
+    """
+
+    def __init__(self, jsonl_path: str = None, prom_path: str = None):
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.run_id = uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._totals = {}
+
+        for path in (jsonl_path, prom_path):
+            if path:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        stack = self._stack()
+        span_id = uuid.uuid4().hex[:12]
+        parent_id = stack[-1] if stack else None
+        stack.append(span_id)
+
+        start = time.time()
+        t0 = time.perf_counter()
+        # cpu_s is this thread's own CPU; child_cpu_s is what subprocesses
+        # (ffmpeg) reaped during the span used, which is process-wide and so
+        # can include children of spans running concurrently on other threads
+        cpu0, child0 = time.thread_time(), _child_cpu()
+        status, error = "ok", None
+        mem = {}
+        try:
+            with memory_watch() as mem:
+                yield attrs
+        except BaseException as e:
+            status, error = "error", repr(e)
+            raise
+        finally:
+            stack.pop()
+            duration = time.perf_counter() - t0
+            cpu, child_cpu = time.thread_time() - cpu0, _child_cpu() - child0
+            self._emit({
+                "run_id": self.run_id,
+                "span_id": span_id,
+                "parent_id": parent_id,
+                "name": name,
+                "start": start,
+                "end": start + duration,
+                "duration_s": duration,
+                "cpu_s": cpu,
+                "child_cpu_s": child_cpu,
+                "status": status,
+                "error": error,
+                "pid": os.getpid(),
+                "thread": threading.current_thread().name,
+                "attrs": attrs,
+                "memory": mem or None,
+            })
+
+    def record(self, name: str, duration_s: float, **attrs):
+        """
+        Emit a span measured elsewhere (e.g. per-frame work summed over a render).
+        """
+        stack = self._stack()
+        end = time.time()
+        self._emit({
+            "run_id": self.run_id,
+            "span_id": uuid.uuid4().hex[:12],
+            "parent_id": stack[-1] if stack else None,
+            "name": name,
+            "start": end - duration_s,
+            "end": end,
+            "duration_s": duration_s,
+            "status": "ok",
+            "error": None,
+            "pid": os.getpid(),
+            "thread": threading.current_thread().name,
+            "attrs": attrs,
+        })
+
+    def _emit(self, record: dict):
+        with self._lock:
+            total = self._totals.setdefault(
+                record["name"], {"count": 0, "seconds": 0.0, "cpu_seconds": 0.0, "errors": 0, "last": 0.0, "rss_peak_mb": 0.0}
+            )
+            total["count"] += 1
+            total["seconds"] += record["duration_s"]
+            total["last"] = record["duration_s"]
+            total["cpu_seconds"] += record.get("cpu_s", 0.0) + record.get("child_cpu_s", 0.0)
+            if record["status"] != "ok":
+                total["errors"] += 1
+            if record.get("memory"):
+                total["rss_peak_mb"] = max(total["rss_peak_mb"], record["memory"]["tree_rss_peak_mb"])
+
+            if self.jsonl_path:
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            if self.prom_path:
+                self._write_prom()
+
+    def _write_prom(self):
+        lines = []
+        for metric, key, kind in (
+            ("span_seconds_total", "seconds", "counter"),
+            ("span_cpu_seconds_total", "cpu_seconds", "counter"),
+            ("span_count_total", "count", "counter"),
+            ("span_errors_total", "errors", "counter"),
+            ("span_last_seconds", "last", "gauge"),
+            ("span_rss_peak_mb", "rss_peak_mb", "gauge"),
+        ):
+            lines.append(f"# TYPE {PROM_PREFIX}_{metric} {kind}")
+            for name, total in sorted(self._totals.items()):
+                lines.append(f'{PROM_PREFIX}_{metric}{{span="{name}"}} {total[key]}')
+
+        tmp = self.prom_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, self.prom_path)
+
+
+_tracer = Tracer()
+
+def configure_tracing(jsonl_path: str = None, prom_path: str = None):
+    global _tracer
+    _tracer = Tracer(jsonl_path, prom_path)
+    return _tracer
+
+def span(name: str, **attrs):
+    """
+    `with span("generate_image", job=job) as s: s["bytes"] = n`
+    Attributes set on the yielded dict are recorded when the span ends.
+    """
+    return _tracer.span(name, **attrs)
+
+def record_span(name: str, duration_s: float, **attrs):
+    _tracer.record(name, duration_s, **attrs)
+
+def summarize(jsonl_path: str, run_id: str = None) -> list:
+    by_name = {}
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            rec = json.loads(line)
+            if run_id and rec["run_id"] != run_id:
+                continue
+            by_name.setdefault(rec["name"], []).append(rec)
+
+    rows = []
+    for name, recs in by_name.items():
+        durations = sorted(r["duration_s"] for r in recs)
+        n = len(durations)
+        peaks = [r["memory"]["tree_rss_peak_mb"] for r in recs if r.get("memory")]
+        rows.append({
+            "name": name,
+            "count": n,
+            "errors": sum(1 for r in recs if r["status"] != "ok"),
+            "total_s": sum(durations),
+            "mean_s": sum(durations) / n,
+            "p50_s": durations[n // 2],
+            "p95_s": durations[min(n - 1, int(n * 0.95))],
+            "max_s": durations[-1],
+            "cpu_s": sum(r.get("cpu_s", 0.0) for r in recs),
+            "child_cpu_s": sum(r.get("child_cpu_s", 0.0) for r in recs),
+            "rss_peak_mb": max(peaks) if peaks else None,
+        })
+    rows.sort(key=lambda r: r["total_s"], reverse=True)
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("jsonl_path", type=str)
+    parser.add_argument("--run_id", type=str, default=None)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    rows = summarize(args.jsonl_path, args.run_id)
+    if args.json:
+        print(json.dumps(rows, indent=4))
+    else:
+        print(f"{'span':<24}{'count':>7}{'errors':>8}{'total':>10}{'mean':>9}{'p50':>9}{'p95':>9}{'max':>9}{'cpu':>9}{'child cpu':>11}{'rss':>10}")
+        for r in rows:
+            rss = f"{r['rss_peak_mb']:.0f}MB" if r.get("rss_peak_mb") is not None else "-"
+            print(
+                f"{r['name']:<24}{r['count']:>7}{r['errors']:>8}{r['total_s']:>9.1f}s"
+                f"{r['mean_s']:>8.2f}s{r['p50_s']:>8.2f}s{r['p95_s']:>8.2f}s{r['max_s']:>8.2f}s"
+                f"{r['cpu_s']:>8.1f}s{r['child_cpu_s']:>10.1f}s{rss:>10}"
+            )
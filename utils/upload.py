@@ -11,17 +11,29 @@ import requests
 import os
 import json
 import mimetypes
+import mmap
+import random
+import time
+import datetime
+import threading
 from typing import Optional, List
 
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from google.auth.transport.requests import Request, AuthorizedSession
+
+from utils.scheduler import provider_slot
+from utils.trace import span
 
 SCOPES = ["https://www.googleapis.com/auth/youtube.upload"]
 
-def get_authenticated_youtube(
+YOUTUBE_UPLOAD_URL = "https://www.googleapis.com/upload/youtube/v3/videos"
+
+# resumable chunks must be a multiple of 256 KiB
+UPLOAD_CHUNK_ALIGN = 256 * 1024
+RETRYABLE_STATUS = (500, 502, 503, 504)
+
+def get_credentials(
     client_secrets_file: str = "./data/client_secret.json",
     token_file: str = "./data/youtube_token.json",
 ):
@@ -41,7 +53,179 @@ def get_authenticated_youtube(
         with open(token_file, "w", encoding="utf-8") as f:
             f.write(creds.to_json())
 
-    return build("youtube", "v3", credentials=creds)
+    return creds
+
+# refresh this long before the access token actually expires
+TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+
+class YouTubeClient:
+    """
+    Long-lived YouTube client: credentials are loaded once and refreshed only
+    when close to expiry, and uploads share one pooled AuthorizedSession that
+    speaks the resumable upload protocol directly.
+    """
+
+    def __init__(
+        self,
+        client_secrets_file: str = "./data/client_secret.json",
+        token_file: str = "./data/youtube_token.json",
+        pool_size: int = 4,
+    ):
+        self.client_secrets_file = client_secrets_file
+        self.token_file = token_file
+        self._lock = threading.Lock()
+
+        with span("youtube_client_init") as sp:
+            t0 = time.perf_counter()
+            self.creds = get_credentials(client_secrets_file, token_file)
+            sp["credentials_s"] = time.perf_counter() - t0
+
+            t1 = time.perf_counter()
+            self._session = AuthorizedSession(self.creds)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            self._session.mount("https://", adapter)
+            sp["session_s"] = time.perf_counter() - t1
+
+        self.startup_s = time.perf_counter() - t0
+        print(f"[YouTube] client ready in {self.startup_s * 1000:.0f} ms")
+
+    def _ensure_fresh(self):
+        with self._lock:
+            expiry = self.creds.expiry
+            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+            if expiry is not None and expiry - now > TOKEN_REFRESH_MARGIN:
+                return
+
+            with span("youtube_token_refresh"):
+                self.creds.refresh(Request())
+            with open(self.token_file, "w", encoding="utf-8") as f:
+                f.write(self.creds.to_json())
+
+    @property
+    def session(self):
+        self._ensure_fresh()
+        return self._session
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_youtube_client(
+    client_secrets_file: str = "./data/client_secret.json",
+    token_file: str = "./data/youtube_token.json",
+) -> YouTubeClient:
+    key = (os.path.abspath(client_secrets_file), os.path.abspath(token_file))
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = YouTubeClient(client_secrets_file, token_file)
+        return _clients[key]
+
+def get_authorized_session(
+    client_secrets_file: str = "./data/client_secret.json",
+    token_file: str = "./data/youtube_token.json",
+):
+    return get_youtube_client(client_secrets_file, token_file).session
+
+
+def _upload_state_path(file_path: str) -> str:
+    return file_path + ".upload.json"
+
+def _load_upload_state(file_path: str, fingerprint: dict):
+    path = _upload_state_path(file_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    # a re-rendered file or different metadata needs a fresh session
+    if state.get("fingerprint") != fingerprint:
+        return None
+    return state
+
+def _save_upload_state(file_path: str, state: dict):
+    path = _upload_state_path(file_path)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=4)
+    os.replace(tmp, path)
+
+def _clear_upload_state(file_path: str):
+    try:
+        os.remove(_upload_state_path(file_path))
+    except FileNotFoundError:
+        pass
+
+def _with_retries(fn, max_retries: int, what: str, tag: str = "[YouTube]"):
+    """
+    Call `fn`, retrying 5xx responses and connection errors with
+    exponential backoff (1s, 2s, 4s, ... capped at 64s, plus jitter).
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            resp = fn()
+            if resp.status_code not in RETRYABLE_STATUS:
+                return resp
+            error = f"HTTP {resp.status_code}"
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = repr(e)
+
+        if attempt == max_retries:
+            raise RuntimeError(f"{tag} {what} failed after {max_retries} retries: {error}")
+        delay = min(2 ** attempt, 64) + random.random()
+        print(f"{tag} {what}: {error}, retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+def _parse_range_offset(resp) -> int:
+    # 308 carries "Range: bytes=0-N" once the server holds any bytes
+    rng = resp.headers.get("Range")
+    if not rng:
+        return 0
+    return int(rng.rsplit("-", 1)[1]) + 1
+
+def _start_session(session, upload_url, body, total, mime_type, max_retries):
+    resp = _with_retries(
+        lambda: session.post(
+            upload_url,
+            params={"uploadType": "resumable", "part": "snippet,status"},
+            json=body,
+            headers={
+                "X-Upload-Content-Length": str(total),
+                "X-Upload-Content-Type": mime_type,
+            },
+            timeout=60,
+        ),
+        max_retries,
+        "start session",
+    )
+    if resp.status_code != 200 or "Location" not in resp.headers:
+        raise RuntimeError(f"[YouTube] session start failed. status={resp.status_code} body={resp.text[:500]}")
+    return resp.headers["Location"]
+
+def _query_offset(session, session_uri, total, max_retries):
+    """
+    Ask the server how much of the file it already has.
+    Returns (offset, finished_response_or_None), or (None, None) if the
+    session is gone.
+    """
+    resp = _with_retries(
+        lambda: session.put(
+            session_uri,
+            headers={"Content-Range": f"bytes */{total}", "Content-Length": "0"},
+            timeout=60,
+        ),
+        max_retries,
+        "query upload status",
+    )
+    if resp.status_code in (200, 201):
+        return total, resp.json()
+    if resp.status_code == 308:
+        return _parse_range_offset(resp), None
+    if resp.status_code in (404, 410):
+        return None, None
+    raise RuntimeError(f"[YouTube] status query failed. status={resp.status_code} body={resp.text[:500]}")
 
 
 def upload_to_youtube(
@@ -53,8 +237,20 @@ def upload_to_youtube(
     privacy_status: str = "public",
     client_secrets_file: str = "./data/client_secret.json",
     token_file: str = "./data/youtube_token.json",
+    session=None,
+    chunk_size_mb: float = 8,
+    max_retries: int = 8,
+    upload_url: str = YOUTUBE_UPLOAD_URL,
 ) -> str:
-    youtube = get_authenticated_youtube(client_secrets_file, token_file)
+    """
+    Resumable upload over the raw YouTube protocol. The session URI is saved
+    next to the file (`<file>.upload.json`), so a restarted process continues
+    the same upload from the server's byte offset instead of starting over.
+    `session` is any requests-compatible session that adds auth (e.g.
+    AuthorizedSession); `upload_url` can point at a local fake server.
+    """
+    if session is None:
+        session = get_authorized_session(client_secrets_file, token_file)
 
     body = {
         "snippet": {
@@ -73,157 +269,234 @@ def upload_to_youtube(
     if not mime_type:
         mime_type = "video/mp4"
 
-    media = MediaFileUpload(file_path, mimetype=mime_type, resumable=True)
-
-    request = youtube.videos().insert(
-        part="snippet,status",
-        body=body,
-        media_body=media,
-    )
-
-    response = None
-    while response is None:
-        status, response = request.next_chunk()
-        if status:
-            print(f"[YouTube] Uploading... {int(status.progress() * 100)}%")
+    total = os.path.getsize(file_path)
+    chunk_size = max(UPLOAD_CHUNK_ALIGN, int(chunk_size_mb * 1024 * 1024) // UPLOAD_CHUNK_ALIGN * UPLOAD_CHUNK_ALIGN)
+    fingerprint = {
+        "size": total,
+        "mtime": os.path.getmtime(file_path),
+        "body": body,
+        "upload_url": upload_url,
+    }
 
+    with span("upload_to_youtube", title=title, bytes=total) as sp, provider_slot("youtube"):
+        response = None
+        offset = 0
+        state = _load_upload_state(file_path, fingerprint)
+        if state is not None:
+            offset, response = _query_offset(session, state["session_uri"], total, max_retries)
+            if offset is None:
+                print("[YouTube] saved upload session expired, starting over")
+                state = None
+            else:
+                print(f"[YouTube] resuming upload at {offset / total:.0%}")
+
+        if state is None:
+            state = {
+                "session_uri": _start_session(session, upload_url, body, total, mime_type, max_retries),
+                "fingerprint": fingerprint,
+            }
+            offset = 0
+        state["offset"] = offset
+        _save_upload_state(file_path, state)
+
+        start_offset = offset
+        started = time.perf_counter()
+        with open(file_path, "rb") as f:
+            while response is None:
+                f.seek(offset)
+                chunk = f.read(chunk_size)
+                end = offset + len(chunk) - 1
+
+                resp = _with_retries(
+                    lambda: session.put(
+                        state["session_uri"],
+                        data=chunk,
+                        headers={
+                            "Content-Type": mime_type,
+                            "Content-Length": str(len(chunk)),
+                            "Content-Range": f"bytes {offset}-{end}/{total}",
+                        },
+                        timeout=300,
+                    ),
+                    max_retries,
+                    "upload chunk",
+                )
+
+                if resp.status_code in (200, 201):
+                    response = resp.json()
+                elif resp.status_code == 308:
+                    offset = _parse_range_offset(resp)
+                    state["offset"] = offset
+                    _save_upload_state(file_path, state)
+                    print(f"[YouTube] Uploading... {int(offset / total * 100)}%")
+                else:
+                    raise RuntimeError(
+                        f"[YouTube] chunk upload failed. status={resp.status_code} body={resp.text[:500]}"
+                    )
+
+        elapsed = time.perf_counter() - started
+        sent = total - start_offset
+        mbps = sent / 1024 ** 2 / elapsed if elapsed > 0 else 0.0
+        sp["sent_bytes"] = sent
+        sp["mb_per_s"] = mbps
+        print(f"[YouTube] sent {sent / 1024 ** 2:.1f} MB in {elapsed:.1f}s ({mbps:.2f} MB/s)")
+
+    _clear_upload_state(file_path)
     video_id = response["id"]
     return video_id
 
 
-# # -----------------------------
-# # TikTok upload (Content Posting API - Inbox Draft)
-# # -----------------------------
-# TIKTOK_OPEN_API = "https://open.tiktokapis.com"
-# TIKTOK_INIT_INBOX_UPLOAD = f"{TIKTOK_OPEN_API}/v2/post/publish/inbox/video/init/"
-
-
-# @dataclass
-# class TikTokUploadResult:
-#     publish_id: str
-#     upload_url: str
-
-
-# def _tiktok_init_inbox_upload(
-#     access_token: str,
-#     video_size: int,
-#     chunk_size: int,
-#     total_chunk_count: int,
-# ) -> TikTokUploadResult:
-#     """
-#     Step 1) Initialize TikTok inbox video upload.
-#     Returns publish_id + upload_url.
-#     """
-#     headers = {
-#         "Authorization": f"Bearer {access_token}",
-#         "Content-Type": "application/json; charset=UTF-8",
-#     }
-#     payload = {
-#         "source_info": {
-#             "source": "FILE_UPLOAD",
-#             "video_size": video_size,
-#             "chunk_size": chunk_size,
-#             "total_chunk_count": total_chunk_count,
-#         }
-#     }
-
-#     r = requests.post(TIKTOK_INIT_INBOX_UPLOAD, headers=headers, json=payload, timeout=60)
-#     # TikTok returns data + error object; handle both
-#     try:
-#         j = r.json()
-#     except Exception:
-#         raise RuntimeError(f"[TikTok] init failed (non-json). status={r.status_code} body={r.text[:500]}")
-
-#     if r.status_code != 200 or "data" not in j:
-#         raise RuntimeError(f"[TikTok] init failed. status={r.status_code} body={j}")
-
-#     data = j["data"]
-#     publish_id = data["publish_id"]
-#     upload_url = data["upload_url"]
-#     print(f"[TikTok] init ok. publish_id={publish_id}")
-#     return TikTokUploadResult(publish_id=publish_id, upload_url=upload_url)
-
-
-# def _tiktok_put_chunk(
-#     upload_url: str,
-#     chunk_bytes: bytes,
-#     start: int,
-#     end: int,
-#     total: int,
-#     content_type: str = "video/mp4",
-# ) -> None:
-#     """
-#     Step 2) PUT one chunk to upload_url with Content-Range.
-#     """
-#     headers = {
-#         "Content-Type": content_type,
-#         "Content-Length": str(len(chunk_bytes)),
-#         "Content-Range": f"bytes {start}-{end}/{total}",
-#     }
-#     r = requests.put(upload_url, headers=headers, data=chunk_bytes, timeout=300)
-#     if r.status_code not in (200, 201, 204):
-#         raise RuntimeError(f"[TikTok] PUT chunk failed. status={r.status_code} body={r.text[:500]}")
-
-
-# def upload_to_tiktok_inbox_draft(
-#     video_path: str,
-#     access_token: str,
-#     chunk_size_mb: int = 32,
-# ) -> str:
-#     """
-#     Upload a video to TikTok as an Inbox Draft (user must open TikTok notification to post/edit).
-
-#     Returns: publish_id (useful for tracking/debug).
-#     Notes:
-#       - Requires `video.upload` scope authorized by the TikTok user. :contentReference[oaicite:1]{index=1}
-#       - Chunk rules: 5MB~64MB per chunk (final chunk may be up to 128MB). :contentReference[oaicite:2]{index=2}
-#     """
-#     if not os.path.exists(video_path):
-#         raise FileNotFoundError(video_path)
-
-#     total_size = os.path.getsize(video_path)
-
-#     # enforce TikTok chunk rules (choose safe chunk size)
-#     chunk_size = chunk_size_mb * 1024 * 1024
-#     chunk_size = max(chunk_size, 5 * 1024 * 1024)
-#     chunk_size = min(chunk_size, 64 * 1024 * 1024)
-
-#     if total_size <= 5 * 1024 * 1024:
-#         chunk_size = total_size  # must upload whole for tiny files
-
-#     total_chunks = max(1, math.ceil(total_size / chunk_size))
-#     if total_chunks > 1000:
-#         raise RuntimeError(f"[TikTok] Too many chunks ({total_chunks}). Reduce chunk size or video length.")
-
-#     init = _tiktok_init_inbox_upload(
-#         access_token=access_token,
-#         video_size=total_size,
-#         chunk_size=chunk_size,
-#         total_chunk_count=total_chunks,
-#     )
-
-#     # Upload sequentially
-#     with open(video_path, "rb") as f:
-#         for idx in range(total_chunks):
-#             start = idx * chunk_size
-#             f.seek(start)
-#             data = f.read(chunk_size)
-#             if not data:
-#                 break
-#             end = start + len(data) - 1
-#             _tiktok_put_chunk(
-#                 upload_url=init.upload_url,
-#                 chunk_bytes=data,
-#                 start=start,
-#                 end=end,
-#                 total=total_size,
-#                 content_type="video/mp4",
-#             )
-#             pct = int(((idx + 1) / total_chunks) * 100)
-#             print(f"[TikTok] Uploading... {pct}% (chunk {idx+1}/{total_chunks})")
-
-#     print("[TikTok] Done. Draft uploaded. User must open TikTok inbox notification to post/edit.")
-#     return init.publish_id
+# -----------------------------
+# TikTok upload (Content Posting API - Inbox Draft)
+# -----------------------------
+TIKTOK_OPEN_API = "https://open.tiktokapis.com"
+TIKTOK_INIT_INBOX_PATH = "/v2/post/publish/inbox/video/init/"
+
+
+@dataclass
+class TikTokUploadResult:
+    publish_id: str
+    upload_url: str
+
+
+def _tiktok_init_inbox_upload(
+    access_token: str,
+    video_size: int,
+    chunk_size: int,
+    total_chunk_count: int,
+    api_base: str = TIKTOK_OPEN_API,
+) -> TikTokUploadResult:
+    """
+    Step 1) Initialize TikTok inbox video upload.
+    Returns publish_id + upload_url.
+    """
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json; charset=UTF-8",
+    }
+    payload = {
+        "source_info": {
+            "source": "FILE_UPLOAD",
+            "video_size": video_size,
+            "chunk_size": chunk_size,
+            "total_chunk_count": total_chunk_count,
+        }
+    }
+
+    r = requests.post(api_base + TIKTOK_INIT_INBOX_PATH, headers=headers, json=payload, timeout=60)
+    # TikTok returns data + error object; handle both
+    try:
+        j = r.json()
+    except Exception:
+        raise RuntimeError(f"[TikTok] init failed (non-json). status={r.status_code} body={r.text[:500]}")
+
+    if r.status_code != 200 or "data" not in j:
+        raise RuntimeError(f"[TikTok] init failed. status={r.status_code} body={j}")
+
+    data = j["data"]
+    publish_id = data["publish_id"]
+    upload_url = data["upload_url"]
+    print(f"[TikTok] init ok. publish_id={publish_id}")
+    return TikTokUploadResult(publish_id=publish_id, upload_url=upload_url)
+
+
+def _tiktok_put_chunk(
+    upload_url: str,
+    chunk: memoryview,
+    start: int,
+    end: int,
+    total: int,
+    content_type: str = "video/mp4",
+    max_retries: int = 5,
+) -> None:
+    """
+    Step 2) PUT one chunk to upload_url with Content-Range.
+    `chunk` is a view into the memory-mapped file, sent without copying.
+    """
+    headers = {
+        "Content-Type": content_type,
+        "Content-Length": str(len(chunk)),
+        "Content-Range": f"bytes {start}-{end}/{total}",
+    }
+    r = _with_retries(
+        lambda: requests.put(upload_url, headers=headers, data=chunk, timeout=300),
+        max_retries,
+        f"PUT chunk {start}-{end}",
+        tag="[TikTok]",
+    )
+    if r.status_code not in (200, 201, 204, 206):
+        raise RuntimeError(f"[TikTok] PUT chunk failed. status={r.status_code} body={r.text[:500]}")
+
+
+def upload_to_tiktok_inbox_draft(
+    video_path: str,
+    access_token: str,
+    chunk_size_mb: int = 32,
+    api_base: str = TIKTOK_OPEN_API,
+    max_retries: int = 5,
+) -> str:
+    """
+    Upload a video to TikTok as an Inbox Draft (user must open TikTok notification to post/edit).
+
+    Returns: publish_id (useful for tracking/debug).
+    Notes:
+      - Requires `video.upload` scope authorized by the TikTok user.
+      - Chunk rules: 5MB~64MB per chunk (final chunk may be up to 128MB).
+      - Chunks are slices of an mmap of the file, so nothing is copied into Python bytes.
+    """
+    if not os.path.exists(video_path):
+        raise FileNotFoundError(video_path)
+
+    total_size = os.path.getsize(video_path)
+
+    # enforce TikTok chunk rules (choose safe chunk size)
+    chunk_size = chunk_size_mb * 1024 * 1024
+    chunk_size = max(chunk_size, 5 * 1024 * 1024)
+    chunk_size = min(chunk_size, 64 * 1024 * 1024)
+
+    if total_size <= 5 * 1024 * 1024:
+        chunk_size = total_size  # must upload whole for tiny files
+
+    # TikTok folds the remainder into the last chunk rather than sending a short one
+    total_chunks = max(1, total_size // chunk_size)
+    if total_chunks > 1000:
+        raise RuntimeError(f"[TikTok] Too many chunks ({total_chunks}). Reduce chunk size or video length.")
+
+    with span("upload_to_tiktok", bytes=total_size, chunks=total_chunks), provider_slot("tiktok"):
+        init = _tiktok_init_inbox_upload(
+            access_token=access_token,
+            video_size=total_size,
+            chunk_size=chunk_size,
+            total_chunk_count=total_chunks,
+            api_base=api_base,
+        )
+
+        with open(video_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                for idx in range(total_chunks):
+                    start = idx * chunk_size
+                    stop = total_size if idx == total_chunks - 1 else start + chunk_size
+                    chunk = view[start:stop]
+                    try:
+                        _tiktok_put_chunk(
+                            upload_url=init.upload_url,
+                            chunk=chunk,
+                            start=start,
+                            end=stop - 1,
+                            total=total_size,
+                            content_type="video/mp4",
+                            max_retries=max_retries,
+                        )
+                    finally:
+                        chunk.release()
+                    pct = int(((idx + 1) / total_chunks) * 100)
+                    print(f"[TikTok] Uploading... {pct}% (chunk {idx+1}/{total_chunks})")
+            finally:
+                view.release()
+
+    print("[TikTok] Done. Draft uploaded. User must open TikTok inbox notification to post/edit.")
+    return init.publish_id
 
 
 # # -----------------------------
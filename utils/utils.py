@@ -1,6 +1,8 @@
+from functools import lru_cache
 from PIL import ImageFont
 import re
 
+@lru_cache(maxsize=None)
 def get_font(path: str, size: int):
     return ImageFont.truetype(path, size=size)
 
@@ -11,6 +13,10 @@ def sanitize_file_name(s: str):
     return s
 
 def find_unused_pair(data):
+    # dataset stores answer this themselves (indexed for sqlite)
+    if hasattr(data, "find_unused"):
+        return data.find_unused()
+
     return [
         (job, value.get("animals", []))
         for job, value in data.items()
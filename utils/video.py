@@ -1,9 +1,18 @@
+import os
+import json
+import time
+import hashlib
+import subprocess
 import numpy as np
 import replicate
 from PIL import Image, ImageFilter, ImageDraw, ImageFont
-from moviepy import VideoFileClip, ImageClip
+from moviepy import ImageClip
 
-from utils.utils import get_font
+from utils.utils import get_font, sanitize_file_name
+from utils.cache import asset_key, file_sha256, recorded_key, forget_key
+from utils.download import download_to, is_valid
+from utils.scheduler import provider_slot
+from utils.trace import span
 
 IMAGE_PROMPT = """Cinematic photographic image, ultra-realistic, natural and lifelike lighting.
 A towering anthropomorphic {animal} portrayed as a professional {job}, with a powerful yet elegant physique and confident upright posture.
@@ -56,42 +65,136 @@ Ultra-smooth cinematic motion with shallow depth of field.
 
 FONT_PATH = "./data/fonts/PlayfairDisplay-VariableFont_wght.ttf"
 
-def generate_image(job: str, animal: str, image_path: str):
-    prompt = IMAGE_PROMPT.format(job=job, animal=animal)
-
-    print(f"[Seedream-4] Creating image of {animal}")
-
-    output = replicate.run(
-        "bytedance/seedream-4",
-        input={
-            "prompt": prompt,
-            "aspect_ratio": "9:16"
-        },
-    )
-
-    img_file = output[0]
-    with open(image_path, "wb") as f:
-        f.write(img_file.read())
-
-def generate_video(job: str, animal: str, image_path: str, video_path: str):
-    prompt = VIDEO_PROMPT.format(job=job, animal=animal)
-
-    print(f"[Seedance-1-pro-fast] Creating video of {animal}")
-    with open(image_path, "rb") as image:
-        output = replicate.run(
-            "bytedance/seedance-1-pro-fast",
-            input={
-                "image": image,
-                "prompt": prompt,
-                "fps": 24,
-                "duration": 4,
-                "aspect_ratio": "9:16",
-                "resolution": "720p",
-            }
-        )
-
-    with open(video_path, "wb") as file:
-        file.write(output.read())
+INTRO_BLUR_RADIUS = 12
+# blur at 1/4 resolution with a 1/4 radius, then upscale: visually the same, far cheaper
+INTRO_BLUR_SCALE = 4
+
+IMAGE_MODEL = "bytedance/seedream-4"
+VIDEO_MODEL = "bytedance/seedance-1-pro-fast"
+
+IMAGE_PARAMS = {
+    "aspect_ratio": "9:16",
+}
+
+VIDEO_PARAMS = {
+    "fps": 24,
+    "duration": 4,
+    "aspect_ratio": "9:16",
+    "resolution": "720p",
+}
+
+def image_key(job: str, animal: str) -> str:
+    return asset_key(IMAGE_MODEL, IMAGE_PROMPT.format(job=job, animal=animal), IMAGE_PARAMS)
+
+def video_key(job: str, animal: str, image_path: str) -> str:
+    return asset_key(VIDEO_MODEL, VIDEO_PROMPT.format(job=job, animal=animal), VIDEO_PARAMS, input_path=image_path)
+
+def generate_image(job: str, animal: str, image_path: str, cache=None):
+    with span("generate_image", job=job, animal=animal) as sp:
+        prompt = IMAGE_PROMPT.format(job=job, animal=animal)
+
+        key = None
+        if cache is not None:
+            key = image_key(job, animal)
+            if cache.fetch(key, image_path):
+                print(f"[Cache] image hit for {animal}")
+                sp["cache_hit"] = True
+                return
+            # a valid file is adopted only if it was made from this exact prompt
+            if recorded_key(image_path) == key and is_valid(image_path, validate_image):
+                print(f"[Cache] adopting existing image for {animal}")
+                cache.store(key, image_path)
+                sp["adopted"] = True
+                return
+
+        print(f"[Seedream-4] Creating image of {animal}")
+
+        with provider_slot("replicate"):
+            output = replicate.run(
+                IMAGE_MODEL,
+                input={
+                    "prompt": prompt,
+                    **IMAGE_PARAMS,
+                },
+            )
+
+        forget_key(image_path)
+        sp["bytes"] = download_to(output[0], image_path, validate=validate_image, tag="[Seedream-4]")
+
+        if cache is not None:
+            cache.store(key, image_path)
+
+def generate_video(job: str, animal: str, image_path: str, video_path: str, cache=None):
+    with span("generate_video", job=job, animal=animal) as sp:
+        prompt = VIDEO_PROMPT.format(job=job, animal=animal)
+
+        key = None
+        if cache is not None:
+            key = video_key(job, animal, image_path)
+            if cache.fetch(key, video_path):
+                print(f"[Cache] video hit for {animal}")
+                sp["cache_hit"] = True
+                return
+            if recorded_key(video_path) == key and is_valid(video_path, validate_video):
+                print(f"[Cache] adopting existing video for {animal}")
+                cache.store(key, video_path)
+                sp["adopted"] = True
+                return
+
+        print(f"[Seedance-1-pro-fast] Creating video of {animal}")
+        with provider_slot("replicate"), open(image_path, "rb") as image:
+            output = replicate.run(
+                VIDEO_MODEL,
+                input={
+                    "image": image,
+                    "prompt": prompt,
+                    **VIDEO_PARAMS,
+                }
+            )
+
+        forget_key(video_path)
+        sp["bytes"] = download_to(output, video_path, validate=validate_video, tag="[Seedance-1-pro-fast]")
+
+        if cache is not None:
+            cache.store(key, video_path)
+
+def validate_image(path: str):
+    with Image.open(path) as img:
+        img.load()  # full decode, catches truncated files
+
+def validate_video(path: str, params: dict = VIDEO_PARAMS):
+    """
+    Raise unless `path` probes as a video matching `params` (duration, fps and
+    the short side of the requested resolution, within small tolerances).
+    """
+    probe = probe_video(path)
+    short_side = min(probe["width"], probe["height"])
+    expected_side = int(params["resolution"].rstrip("p"))
+    if abs(probe["duration"] - params["duration"]) > 0.5:
+        raise ValueError(f"duration {probe['duration']:.2f}s, expected {params['duration']}s")
+    if abs(probe["fps"] - params["fps"]) > 1:
+        raise ValueError(f"fps {probe['fps']:.2f}, expected {params['fps']}")
+    if abs(short_side - expected_side) > 16:
+        raise ValueError(f"{probe['width']}x{probe['height']}, expected {params['resolution']}")
+
+def ensure_image(job: str, animal: str, output_path: str, cache=None):
+    job_s = sanitize_file_name(job)
+    animal_s = sanitize_file_name(animal)
+
+    # with a cache, the prompt-keyed lookup runs first; an existing file is only kept if its recorded key matches
+    image_path = os.path.join(output_path, f"{job_s}_{animal_s}.jpg")
+    if cache is not None or not is_valid(image_path, validate_image):
+        generate_image(job, animal, image_path, cache=cache)
+    return image_path
+
+def ensure_video(job: str, animal: str, image_path: str, output_path: str, cache=None):
+    job_s = sanitize_file_name(job)
+    animal_s = sanitize_file_name(animal)
+
+    video_path = os.path.join(output_path, f"{job_s}_{animal_s}.mp4")
+    if cache is not None or not is_valid(video_path, validate_video):
+        generate_video(job, animal, image_path, video_path, cache=cache)
+    return video_path
 
 def _draw_center_text(img: Image.Image, job: str, font_main: ImageFont.ImageFont, font_job: ImageFont.ImageFont):
     draw = ImageDraw.Draw(img)
@@ -137,26 +240,223 @@ def _draw_top_label(img: Image.Image, text: str, font: ImageFont.ImageFont):
 
     return img
 
-def make_intro(first_video_path: str, job: str, intro_sec: float = 1.5):
-    base = VideoFileClip(first_video_path)
-    frame = base.get_frame(0)
-    img = Image.fromarray(frame).filter(ImageFilter.GaussianBlur(radius=12))
+def _text_layer(size, xy, text: str, font: ImageFont.ImageFont, fill):
+    mask = Image.new("L", size, 0)
+    ImageDraw.Draw(mask).text(xy, text, font=font, fill=255)
+    layer = Image.new("RGBA", size, fill + (0,))
+    layer.putalpha(mask)
+    return layer
+
+def caption_font(frame_width: int):
+    return get_font(FONT_PATH, size=max(54, int(frame_width / 12)))
+
+def render_label_image(text: str, font: ImageFont.ImageFont, frame_size) -> Image.Image:
+    """
+    Full-frame transparent RGBA image holding the top label and its shadow,
+    positioned exactly like `_draw_top_label`.
+    """
+    W, H = frame_size
+    bbox = ImageDraw.Draw(Image.new("L", (1, 1))).textbbox((0, 0), text, font=font)
+    tw = bbox[2] - bbox[0]
+
+    x = (W - tw) // 2
+    y = int(H * 0.035)
+    shadow = max(2, font.size // 14)
+
+    return Image.alpha_composite(
+        _text_layer((W, H), (x + shadow, y + shadow), text, font, (0, 0, 0)),
+        _text_layer((W, H), (x, y), text, font, (255, 255, 255)),
+    )
+
+def render_label_sprite(text: str, font: ImageFont.ImageFont, frame_size):
+    """
+    Rasterize the top label once. Returns (x, y, rgb, alpha) where rgb/alpha
+    are float32 arrays covering only the label's bounding box.
+    """
+    sprite = render_label_image(text, font, frame_size)
+    box = sprite.getbbox()
+    if box is None:
+        return 0, 0, np.zeros((0, 0, 3), np.float32), np.zeros((0, 0, 1), np.float32)
+
+    arr = np.asarray(sprite.crop(box), dtype=np.float32)
+    rgb = arr[..., :3]
+    alpha = arr[..., 3:4] / 255.0
+    return box[0], box[1], rgb, alpha
+
+def composite_sprite_inplace(frame: np.ndarray, sprite) -> np.ndarray:
+    x, y, rgb, alpha = sprite
+    h, w = alpha.shape[:2]
+    if h == 0 or w == 0:
+        return frame
+
+    region = frame[y:y + h, x:x + w].astype(np.float32)
+    region += (rgb - region) * alpha
+    frame[y:y + h, x:x + w] = np.clip(region + 0.5, 0, 255).astype(frame.dtype)
+    return frame
+
+def composite_sprite(frame: np.ndarray, sprite) -> np.ndarray:
+    if sprite[3].size == 0:
+        return frame
+    return composite_sprite_inplace(frame.copy(), sprite)
+
+def probe_video(path: str) -> dict:
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,r_frame_rate:format=duration",
+        "-of", "json",
+        path,
+    ]
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    info = json.loads(out)
+    stream = info["streams"][0]
+    num, den = stream["r_frame_rate"].split("/")
+    return {
+        "width": int(stream["width"]),
+        "height": int(stream["height"]),
+        "fps": float(num) / float(den) if float(den) else 0.0,
+        "duration": float(info["format"]["duration"]),
+    }
+
+def extract_first_frame(video_path: str, probe: dict = None) -> np.ndarray:
+    """
+    Decode only frame 0 with a single ffmpeg call straight to raw RGB.
+    """
+    probe = probe or probe_video(video_path)
+    W, H = probe["width"], probe["height"]
+    cmd = [
+        "ffmpeg", "-v", "error",
+        "-i", video_path,
+        "-frames:v", "1",
+        "-f", "rawvideo", "-pix_fmt", "rgb24",
+        "-",
+    ]
+    raw = subprocess.run(cmd, check=True, capture_output=True).stdout
+    return np.frombuffer(raw, dtype=np.uint8, count=W * H * 3).reshape(H, W, 3)
+
+def fast_blur(img: Image.Image, radius: float = INTRO_BLUR_RADIUS, scale: int = INTRO_BLUR_SCALE) -> Image.Image:
+    W, H = img.size
+    small = img.resize((max(1, W // scale), max(1, H // scale)), Image.BILINEAR)
+    small = small.filter(ImageFilter.GaussianBlur(radius=radius / scale))
+    return small.resize((W, H), Image.BICUBIC)
+
+def _intro_cache_path(first_video_path: str, job: str, cache_dir: str) -> str:
+    key = hashlib.sha256(json.dumps({
+        "job": job,
+        "source": file_sha256(first_video_path),
+        "blur": [INTRO_BLUR_RADIUS, INTRO_BLUR_SCALE],
+        "font": FONT_PATH,
+    }, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"intro_{key}.png")
+
+def render_intro_image(first_video_path: str, job: str, cache_dir: str = None):
+    """
+    Blurred first frame with the title text. With `cache_dir`, the result is
+    stored under a key of (job, source clip hash, blur settings) and later
+    renders skip decoding entirely.
+    """
+    probe = probe_video(first_video_path)
+
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = _intro_cache_path(first_video_path, job, cache_dir)
+        if os.path.exists(cache_path):
+            with Image.open(cache_path) as cached:
+                return cached.convert("RGB"), probe["fps"]
+
+    frame = extract_first_frame(first_video_path, probe)
+    img = fast_blur(Image.fromarray(frame))
 
     font_main = get_font(FONT_PATH, size=max(48, img.size[0] // 13))
     font_job  = get_font(FONT_PATH, size=max(96, img.size[0] // 10))
 
     img = _draw_center_text(img, job, font_main, font_job)
 
-    intro_clip = ImageClip(np.array(img)).with_duration(intro_sec).with_fps(base.fps)
-    base.close()
-    return intro_clip
-
-def overlay_top_caption(clip, caption: str):
-    font = get_font(FONT_PATH, size=max(54, int(clip.w / 12)))
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = cache_path + ".tmp.png"
+        img.save(tmp)
+        os.replace(tmp, cache_path)
+    return img, probe["fps"]
+
+def ensure_intro_image(first_video_path: str, job: str, cache_dir: str):
+    """
+    Path of the cached intro still, rendering it only on a miss.
+    Returns (png_path, fps).
+    """
+    cache_path = _intro_cache_path(first_video_path, job, cache_dir)
+    if os.path.exists(cache_path):
+        return cache_path, probe_video(first_video_path)["fps"]
+    _, fps = render_intro_image(first_video_path, job, cache_dir=cache_dir)
+    return cache_path, fps
+
+def mezzanine_args(size, fps: float = 24, preset: str = "medium", threads: int = 1, crf: int = None):
+    """
+    Filter and encoder settings shared by every mezzanine segment: same
+    W x H canvas, fps, pixel format and timescale, so segments can be joined
+    with the concat demuxer by stream copy. Returns (pad_filter, encode_args).
+    """
+    W, H = size
+    pad = f"pad={W}:{H}:(ow-iw)/2:(oh-ih)/2:color=black,setsar=1,fps={fps},format=yuv420p"
+    encode = ["-an", "-c:v", "libx264", "-preset", preset, "-threads", str(threads)]
+    if crf is not None:
+        encode += ["-crf", str(crf)]
+    encode += ["-video_track_timescale", "90000", "-f", "mp4"]
+    return pad, encode
+
+def intro_segment(
+    intro_image_path: str,
+    intro_sec: float,
+    size,
+    fps: float = 24,
+    preset: str = "medium",
+    threads: int = 1,
+    crf: int = None,
+) -> str:
+    """
+    The intro still encoded once as a mezzanine segment, stored next to the
+    cached PNG under the same key plus the encode settings. Later renders
+    with the same settings reuse the file as-is.
+    """
+    settings = json.dumps([intro_sec, list(size), fps, preset, crf]).encode("utf-8")
+    stem = os.path.splitext(intro_image_path)[0]
+    seg_path = f"{stem}_{hashlib.sha256(settings).hexdigest()[:8]}.mp4"
+    if os.path.exists(seg_path):
+        return seg_path
+
+    pad, encode = mezzanine_args(size, fps, preset, threads, crf)
+    tmp = seg_path + ".part.mp4"
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-loop", "1", "-framerate", str(fps), "-t", f"{intro_sec}", "-i", intro_image_path,
+        "-vf", pad,
+    ] + encode + [tmp]
+    with span("encode_intro", preset=preset):
+        subprocess.run(cmd, check=True)
+    os.replace(tmp, seg_path)
+    return seg_path
+
+def make_intro(first_video_path: str, job: str, intro_sec: float = 1.5, cache_dir: str = None):
+    with span("make_intro", job=job):
+        img, fps = render_intro_image(first_video_path, job, cache_dir=cache_dir)
+        return ImageClip(np.array(img)).with_duration(intro_sec).with_fps(fps)
+
+def overlay_top_caption(clip, caption: str, stats: dict = None):
+    """
+    `stats`, if given, accumulates {"frames", "seconds"} spent compositing,
+    since the per-frame work only happens lazily during the encode.
+    """
+    font = caption_font(clip.w)
+    sprite = render_label_sprite(caption, font, (clip.w, clip.h))
 
     def _fn(frame):
-        img = Image.fromarray(frame)
-        img = _draw_top_label(img, caption, font)
-        return np.array(img)
+        if stats is None:
+            return composite_sprite(frame, sprite)
+
+        t0 = time.perf_counter()
+        out = composite_sprite(frame, sprite)
+        stats["seconds"] = stats.get("seconds", 0.0) + time.perf_counter() - t0
+        stats["frames"] = stats.get("frames", 0) + 1
+        return out
 
     return clip.image_transform(_fn)
\ No newline at end of file